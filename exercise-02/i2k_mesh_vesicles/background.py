@@ -0,0 +1,151 @@
+import bpy
+import threading
+import time
+
+# Long operations are split in three steps, so the UI doesn't freeze:
+#   - prepare: read what is needed from bpy data (main thread, fast: foreach_get, ...)
+#   - compute: the heavy NumPy work, in a background thread. It must not touch bpy data.
+#   - apply:   write the results to bpy data, by small batches, from timer events (main thread).
+
+# Task currently running (only one at a time).
+_CURRENT = None
+
+
+class BackgroundTask(object):
+    """
+    State shared between the worker thread and the modal operator.
+    """
+    def __init__(self, label):
+        self.label = label
+        self.progress = 0.0  # Progress of the computation, set by the worker.
+        self.displayed = 0.0 # Progress shown in the panel (computation + application of the results).
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _redraw_panels(context):
+    if context.screen is None:
+        return
+    for area in context.screen.areas:
+        if area.type == 'VIEW_3D':
+            area.tag_redraw()
+
+
+class BackgroundOperator(object):
+    """
+    Mixin for operators running their heavy work in a background thread.
+    Subclasses implement `prepare`, `compute` and `apply` (see above), and optionally `on_cancel`.
+        - compute(data, task): updates `task.progress` (0 to 1) and returns early if `task.cancelled` is set.
+        - apply(context, result): generator yielding the fraction of the results written so far.
+    When invoked from the UI, the operator is modal: it shows its progress in the panel and can be cancelled (Esc or 'Cancel').
+    When executed from a script (or in background mode), the three steps run synchronously.
+    """
+    # Time (in seconds) spent writing results at each timer event.
+    time_budget = 0.02
+
+    def prepare(self, context):
+        return None
+
+    def compute(self, data, task):
+        return None
+
+    def apply(self, context, result):
+        yield 1.0
+
+    def on_cancel(self, context):
+        pass
+
+    def execute(self, context):
+        task = BackgroundTask(self.bl_label)
+        result = self.compute(self.prepare(context), task)
+        for _ in self.apply(context, result):
+            pass
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        global _CURRENT
+        if _CURRENT is not None:
+            self.report({'WARNING'}, f"Wait for '{_CURRENT.label}' to finish, or cancel it")
+            return {'CANCELLED'}
+        data = self.prepare(context)
+        self._task = BackgroundTask(self.bl_label)
+        self._applying = None
+        _CURRENT = self._task
+        threading.Thread(target=self._work, args=(data,), daemon=True).start()
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.05, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def _work(self, data):
+        try:
+            self._task.result = self.compute(data, self._task)
+        except Exception as e:
+            self._task.error = e
+        self._task.finished.set()
+
+    def _finish(self, context, status):
+        global _CURRENT
+        context.window_manager.event_timer_remove(self._timer)
+        _CURRENT = None
+        _redraw_panels(context)
+        return {status}
+
+    def modal(self, context, event):
+        task = self._task
+        if (event.type == 'ESC' and event.value == 'PRESS') or task.cancelled.is_set():
+            task.cancelled.set()
+            self.on_cancel(context)
+            self.report({'WARNING'}, f"{task.label}: cancelled")
+            return self._finish(context, 'CANCELLED')
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if not task.finished.is_set():
+            # The computation counts for the first 80% of the progress bar.
+            task.displayed = 0.8 * task.progress
+            _redraw_panels(context)
+            return {'PASS_THROUGH'}
+        if task.error is not None:
+            self.on_cancel(context)
+            self.report({'ERROR'}, f"{task.label}: {task.error}")
+            return self._finish(context, 'CANCELLED')
+
+        if self._applying is None:
+            self._applying = self.apply(context, task.result)
+        start = time.perf_counter()
+        fraction = 0.0
+        while time.perf_counter() - start < self.time_budget:
+            try:
+                fraction = next(self._applying)
+            except StopIteration:
+                return self._finish(context, 'FINISHED')
+        task.displayed = 0.8 + 0.2 * fraction
+        _redraw_panels(context)
+        return {'PASS_THROUGH'}
+
+
+class OBJECT_OT_cancel_background_task(bpy.types.Operator):
+    bl_idname = "object.cancel_background_task"
+    bl_label = "Cancel"
+    bl_description = "Cancel the operation running in the background"
+
+    def execute(self, context):
+        if _CURRENT is not None:
+            _CURRENT.cancelled.set()
+        return {'FINISHED'}
+
+
+def draw_progress(layout):
+    """
+    Draws the progress bar of the running task (if any) and its cancel button.
+    """
+    task = _CURRENT
+    if task is None:
+        return
+    row = layout.row()
+    row.progress(factor=task.displayed, text=task.label)
+    row.operator("object.cancel_background_task", text="", icon='CANCEL')
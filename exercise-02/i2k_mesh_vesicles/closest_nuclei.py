@@ -1,92 +1,490 @@
 import bpy
 import mathutils
+from mathutils.bvhtree import BVHTree
 import json
+import numpy as np
+from bpy.app.handlers import persistent
+from . import background
 
-def get_total_vertices():
+# Names of the nuclei whose geometry was edited since the last run (filled by the depsgraph handler).
+_EDITED_NUCLEI = set()
+
+# State of the last run, used by the incremental mode.
+_STATE = None
+
+
+@persistent
+def mark_edited_nuclei(scene, depsgraph):
     """
-    Returns the total number of vertices in each nucleus.
+    Depsgraph handler keeping track of the meshes edited in place (the transforms are compared directly).
     """
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and update.is_updated_geometry:
+            _EDITED_NUCLEI.add(update.id.original.name)
+
+
+def get_nuclei():
     collection = bpy.data.collections.get('Nuclei')
     if collection is None:
         print("No Nuclei collection")
         return None
-    acc = 0
-    n_vertices = [len(obj.data.vertices) for obj in collection.objects if obj.type == 'MESH']
-    return sum(n_vertices)
-    
+    return {obj.name: obj for obj in collection.objects if obj.type == 'MESH' and len(obj.data.vertices) > 0}
+
 
-def build_kd_tree():
+def nucleus_arrays(obj):
     """
-    Builds a KD-Tree containing the vertices of all nuclei present in the collection.
-    Returns the KD Tree, and the array of correspondance with objects.
+    Reads the vertices (local space) and the triangles of a nucleus, and its world matrix, as NumPy arrays.
     """
-    ttl_vertices = get_total_vertices()
-    kd = mathutils.kdtree.KDTree(ttl_vertices)
-    vertex_to_object_map = [] # So we can retrieve the closest object
-    normals = [] # Vertices normals, for I/O test
-    
-    collection = bpy.data.collections.get('Nuclei')
-    if collection is None:
-        print("No Nuclei collection")
-        return None
-    
-    for obj in collection.objects:
-        if obj.type != 'MESH':
-            continue
-        mesh = obj.data
-        matrix = obj.matrix_world
-        for i, vert in enumerate(mesh.vertices):
-            normals.append(vert.normal)
-            kd.insert(matrix @ vert.co, len(vertex_to_object_map))
-            vertex_to_object_map.append(obj)
-    
-    kd.balance()
-    return kd, vertex_to_object_map, normals
+    mesh = obj.data
+    mesh.calc_loop_triangles()
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("vertices", triangles)
+    return vertices.reshape(-1, 3), triangles.reshape(-1, 3), np.array(obj.matrix_world)
+
+
+def build_bvh_tree(vertices, triangles, matrix):
+    """
+    Builds a BVH-Tree containing the triangles of a nucleus (see `nucleus_arrays`), in world space.
+    It doesn't touch bpy data, so it can run in a background thread.
+    Returns the BVH Tree, and the center and radius of the nucleus' bounding sphere.
+    """
+    vertices = vertices @ matrix[:3, :3].T + matrix[:3, 3]
+    bvh = BVHTree.FromPolygons(vertices.tolist(), triangles.tolist())
+    center = vertices.mean(axis=0)
+    radius = np.max(np.linalg.norm(vertices - center, axis=1))
+    return bvh, center, radius
+
+
+def read_nuclei(nuclei, state=None):
+    """
+    Reads the nuclei whose BVH-Tree has to be (re)built: the ones that were added, moved or edited since `state` was updated.
+    Returns a dictionary: name -> (transform as a tuple, arrays (see `nucleus_arrays`) or None if the tree is up to date).
+    """
+    data = {}
+    for name, obj in nuclei.items():
+        transform = tuple(v for row in obj.matrix_world for v in row)
+        up_to_date = state is not None and state.transforms.get(name) == transform and name not in _EDITED_NUCLEI
+        data[name] = (transform, None if up_to_date else nucleus_arrays(obj))
+    if state is not None: # Edits are only forgotten once the state that tracks them is updated.
+        _EDITED_NUCLEI.clear()
+    return data
 
 
 def get_spots():
+    """
+    Returns the empties of the spots, their locations and their spot IDs (None for the spots never processed).
+    """
     collection = bpy.data.collections.get('Spots-locations')
     if collection is None:
         print("No Spots collection")
         return None
-    return [(tuple(obj.location), obj) for obj in collection.objects if obj.type == 'EMPTY']
+    empties = [obj for obj in collection.objects if obj.type == 'EMPTY']
+    locations = [tuple(obj.location) for obj in empties]
+    ids = [obj.get("spot_id") for obj in empties]
+    return empties, locations, ids
+
+
+def records_to_csv(records):
+    """
+    Writes the metrics of each spot in the "Results_CSV" text block.
+    The signed distance is negative inside the nucleus.
+    """
+    lines = ["spot_id,nucleus,signed_distance,closest_x,closest_y,closest_z,normal_x,normal_y,normal_z,inside"]
+    for spot_id in sorted(records):
+        r = records[spot_id]
+        lines.append(",".join([str(spot_id), r.owner, f"{r.signed_dist:.6f}"] + [f"{v:.6f}" for v in (*r.closest, *r.normal)] + [str(int(r.inside))]))
+    text_name = "Results_CSV"
+    text_block = bpy.data.texts.get(text_name)
+    if text_block is None:
+        text_block = bpy.data.texts.new(name=text_name)
+    text_block.clear()
+    text_block.write("\n".join(lines) + "\n")
 
 
 def counter_to_json(data_dict):
     json_str = json.dumps(data_dict, indent=4)
     text_name = "Results_JSON"
-    # Remove prevouis attempt
-    if text_name in bpy.data.texts:
-        bpy.data.texts.remove(bpy.data.texts[text_name])
-    text_block = bpy.data.texts.new(name=text_name)
+    # Reuse the previous text block, if any.
+    text_block = bpy.data.texts.get(text_name)
+    if text_block is None:
+        text_block = bpy.data.texts.new(name=text_name)
+    text_block.clear()
     text_block.write(json_str)
 
 
-def spot_to_closest_nucleus():
+class SpotRecord(object):
     """
-    Loops through the spots (empties) and searches for the closest vertex.
-    Sets the parent of each spot to its owner nuclei.
-    Counts the number of spots per nuclei
+    What we know about a spot after its last query.
+    Distances are measured to the surface (closest point on a triangle), not to the closest vertex.
+    The competitor is the second closest nucleus: if it moves, it could become the owner.
     """
-    kd, mapping, normals = build_kd_tree()
+    def __init__(self, location, owner, owner_dist, competitor, competitor_dist, closest, normal):
+        self.location = location
+        self.owner = owner
+        self.owner_dist = owner_dist
+        self.competitor = competitor
+        self.competitor_dist = competitor_dist
+        self.closest = closest
+        self.normal = normal
+        # The spot is inside if it is behind the closest face (normals point outwards).
+        self.inside = (mathutils.Vector(location) - closest).dot(normal) <= 0
+        self.signed_dist = -owner_dist if self.inside else owner_dist
+
+
+class OwnershipState(object):
+
+    def __init__(self):
+        self.transforms = {} # nucleus name -> matrix_world (as a tuple) at the time its tree was built.
+        self.trees = {}      # nucleus name -> (BVH-Tree, center, radius)
+        self.spots = {}      # spot ID -> SpotRecord
+        self.counter = {}    # nucleus name -> {'in': n, 'out': n}
+        self.next_id = 0
+        self.dirty = False   # True if the records changed since the last export.
+        self.spheres = ([], np.zeros((0, 3)), np.zeros(0)) # Names, centers and radii of the nuclei, as arrays.
+
+    def update_nuclei(self, nuclei):
+        """
+        Rebuilds the BVH-Trees of the nuclei that were added, moved or edited since the last run.
+        `nuclei` is read by `read_nuclei`: this function doesn't touch bpy data.
+        Returns the set of names of the nuclei that changed (including the removed ones).
+        """
+        changed = set(self.trees) - set(nuclei)
+        for name in changed:
+            del self.trees[name]
+            del self.transforms[name]
+        for name, (transform, arrays) in nuclei.items():
+            if arrays is None:
+                continue
+            self.trees[name] = build_bvh_tree(*arrays)
+            self.transforms[name] = transform
+            changed.add(name)
+        names = list(self.trees)
+        self.spheres = (
+            names,
+            np.array([self.trees[n][1] for n in names]).reshape(-1, 3),
+            np.array([self.trees[n][2] for n in names])
+        )
+        return changed
+
+    def lower_bounds(self, points):
+        """
+        Lower bounds of the distances from each point to each nucleus (distance to its bounding sphere), for all the points at once.
+        Returns the bounds and, for each point, the indices of the nuclei sorted by increasing bound (as lists, faster to loop on).
+        """
+        _, centers, radii = self.spheres
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        bounds = np.linalg.norm(points[:, np.newaxis] - centers[np.newaxis], axis=2) - radii
+        return bounds.tolist(), np.argsort(bounds, axis=1).tolist()
+
+    def closest_two(self, location, bounds=None, order=None):
+        """
+        Returns the (distance, name, closest point, normal) of the two closest nuclei.
+        Nuclei are visited by increasing lower bound (see `lower_bounds`, computed here if not provided),
+        so most BVH-Trees are never queried, and the others are searched within the current second best distance.
+        """
+        if bounds is None:
+            bounds, order = self.lower_bounds([location])
+            bounds, order = bounds[0], order[0]
+        names = self.spheres[0]
+        best = [(float('inf'), None, None, None), (float('inf'), None, None, None)]
+        for i in order:
+            limit = best[1][0]
+            if bounds[i] > limit:
+                break
+            tree = self.trees[names[i]][0]
+            co, normal, _, dist = tree.find_nearest(location) if limit == float('inf') else tree.find_nearest(location, limit)
+            if co is None:
+                continue
+            if dist < best[0][0]:
+                best = [(dist, names[i], co, normal), best[0]]
+            elif dist < best[1][0]:
+                best[1] = (dist, names[i], co, normal)
+        return best
+
+    def _count(self, record, step):
+        if record.owner is None:
+            return
+        counts = self.counter.setdefault(record.owner, {'in': 0, 'out': 0})
+        counts['in' if record.inside else 'out'] += step
+        if counts['in'] == 0 and counts['out'] == 0:
+            del self.counter[record.owner]
+
+    def affected_spots(self, locations, ids, changed):
+        """
+        Selects the spots that have to be queried again:
+            - new spots and spots that moved,
+            - spots whose owner or competitor changed,
+            - spots that a changed nucleus could now reach before their competitor (bounding sphere test).
+        Records of the spots that were removed are dropped.
+        New spots, and copies of a spot (Shift-D copies the custom property), get a new ID.
+        Returns the list of (index of the spot, spot ID, location) to query.
+        """
+        affected = []
+        candidates = []
+        self.next_id = max([self.next_id] + [i + 1 for i in ids if i is not None])
+        present = set()
+        for index, (location, spot_id) in enumerate(zip(locations, ids)):
+            if spot_id is None or spot_id in present:
+                spot_id = self.next_id
+                self.next_id += 1
+            present.add(spot_id)
+            record = self.spots.get(spot_id)
+            if (record is None) or (record.location != location) or (record.owner in changed) or (record.competitor in changed):
+                affected.append((index, spot_id, location))
+            else:
+                candidates.append((index, spot_id, location))
+
+        for spot_id in set(self.spots) - present:
+            self._count(self.spots.pop(spot_id), -1)
+
+        reachable = [self.trees[n] for n in changed if n in self.trees]
+        if len(candidates) > 0 and len(reachable) > 0:
+            c_locations = np.array([location for _, _, location in candidates])
+            limits = np.array([self.spots[i].competitor_dist for _, i, _ in candidates])
+            centers = np.array([c for _, c, _ in reachable])
+            radii = np.array([r for _, _, r in reachable])
+            bounds = np.linalg.norm(c_locations[:, np.newaxis] - centers[np.newaxis], axis=2) - radii
+            reached = np.any(bounds < limits[:, np.newaxis], axis=1)
+            affected += [c for c, r in zip(candidates, reached) if r]
+        return affected
+
+    def query(self, location, bounds=None, order=None):
+        """
+        Returns the SpotRecord of a location, or None if there is no nucleus.
+        """
+        (dist, owner, co, normal), (c_dist, competitor, _, _) = self.closest_two(location, bounds, order)
+        if owner is None:
+            return None
+        return SpotRecord(location, owner, dist, competitor, c_dist, co, normal)
+
+    def query_many(self, locations):
+        """
+        Same as `query` for a list of locations, the lower bounds are computed for all of them at once.
+        """
+        bounds, order = self.lower_bounds(locations)
+        return [self.query(location, b, o) for location, b, o in zip(locations, bounds, order)]
+
+    def closest_many(self, points, chunk_size=4096):
+        """
+        Searches the closest nucleus of each point of an (N, 3) array, without building records.
+        Only the closest nucleus is searched (not the competitor), and the bounds are computed by chunks of points:
+        each point is first measured against the nucleus with the lowest bound, then the other nuclei are only
+        searched for the points where one of them could be closer.
+        Returns the index of the closest nucleus in `spheres[0]` (-1 if there is none), the distance to its surface,
+        and whether the point is inside it, as arrays.
+        """
+        _, centers, radii = self.spheres
+        trees = [self.trees[name][0] for name in self.spheres[0]]
+        n_points = len(points)
+        owners = np.full(n_points, -1, dtype=np.int32)
+        distances = np.full(n_points, np.inf)
+        closest = np.zeros((n_points, 3))
+        normals = np.zeros((n_points, 3))
+        if len(trees) == 0:
+            return owners, distances, np.zeros(n_points, dtype=bool)
+        for start in range(0, n_points, chunk_size):
+            chunk = points[start:start + chunk_size]
+            locations = chunk.tolist()
+            bounds = np.linalg.norm(chunk[:, np.newaxis] - centers[np.newaxis], axis=2) - radii
+            first = np.argmin(bounds, axis=1)
+            found = [trees[i].find_nearest(location) for location, i in zip(locations, first.tolist())]
+            dist = np.array([f[3] for f in found])
+            own = first.astype(np.int32)
+            co = np.array([f[0] for f in found])
+            normal = np.array([f[1] for f in found])
+
+            bounds[np.arange(len(chunk)), first] = np.inf
+            for k in np.flatnonzero(np.any(bounds < dist[:, np.newaxis], axis=1)).tolist():
+                row = bounds[k]
+                for i in np.argsort(row).tolist():
+                    if row[i] > dist[k]:
+                        break
+                    c, n, _, d = trees[i].find_nearest(locations[k], dist[k])
+                    if c is not None and d < dist[k]:
+                        dist[k], own[k], co[k], normal[k] = d, i, c, n
+            owners[start:start + len(chunk)] = own
+            distances[start:start + len(chunk)] = dist
+            closest[start:start + len(chunk)] = co
+            normals[start:start + len(chunk)] = normal
+        # Same test as in SpotRecord: the point is inside if it is behind the closest face.
+        inside = np.einsum('ij,ij->i', points - closest, normals) <= 0
+        return owners, distances, inside
+
+    def record(self, spot_id, record):
+        """
+        Stores the record of a spot and updates the counters.
+        """
+        previous = self.spots.get(spot_id)
+        if previous is not None:
+            self._count(previous, -1)
+        self._count(record, 1)
+        self.spots[spot_id] = record
+
+
+def reset_ownership():
+    """
+    Forgets the state of the last run, the next one will process all the spots.
+    """
+    global _STATE
+    _STATE = None
+
+
+def prepare_ownership(incremental=False):
+    """
+    Main thread part of `spot_to_closest_nucleus`: reads the nuclei that changed and the spots.
+    Only arrays and tuples are read here, the heavy work is done by `compute_ownership`.
+    Returns the state, the nuclei (see `read_nuclei`), the empties, their locations and their IDs,
+    or None if there are no nuclei or spots.
+    """
+    global _STATE
+    bpy.context.view_layer.update() # Makes sure that the world matrices are up to date.
+    nuclei = get_nuclei()
     spots = get_spots()
-    counter = {}
-    
-    for rank, (s_co, empty) in enumerate(spots):
-        co, index, dist = kd.find(s_co)
-        closest_object = mapping[index]
-        v1 = mathutils.Vector(co) - closest_object.location # origin to surface point
-        v2 = empty.location - mathutils.Vector(co) # vertex to empty
-        v1.normalize()
-        v2.normalize()
-        inside = v1.dot(v2) <= 0
-        empty.name = closest_object.name + "-" + str(rank)
-        empty.empty_display_type = "SPHERE" if inside else "CUBE"
-        counter.setdefault(closest_object.name, {'in': 0, 'out': 0})
-        counter[closest_object.name]['in' if inside else 'out'] += 1
-    counter_to_json(counter)
-    
+    if nuclei is None or spots is None:
+        return None
+    if not incremental or _STATE is None:
+        _STATE = OwnershipState()
+    return (_STATE, read_nuclei(nuclei, _STATE)) + spots
+
+
+def compute_ownership(state, nuclei, locations, ids, task=None):
+    """
+    Rebuilds the BVH-Trees of the nuclei that changed, selects the spots to query and queries them.
+    It doesn't touch bpy data, so it can run in a background thread.
+    If a background task is provided, its progress is updated and the queries stop if it is cancelled.
+    Returns the list of (index of the spot, spot ID, SpotRecord) tuples.
+    """
+    changed = state.update_nuclei(nuclei)
+    spots = state.affected_spots(locations, ids, changed)
+    records = []
+    for start in range(0, len(spots), 256):
+        if task is not None:
+            if task.cancelled.is_set():
+                break
+            task.progress = start / len(spots)
+        chunk = spots[start:start + 256]
+        found = state.query_many([location for _, _, location in chunk])
+        records += [(index, spot_id, record) for (index, spot_id, _), record in zip(chunk, found)]
+    return records
+
+
+def export_ownership(state=None):
+    """
+    Writes the counters ("Results_JSON") and the per-spot metrics ("Results_CSV") of a state (the last run by default).
+    Returns False if there is nothing to export.
+    """
+    state = _STATE if state is None else state
+    if state is None:
+        return False
+    counter_to_json(state.counter)
+    records_to_csv(state.spots)
+    state.dirty = False
+    return True
+
+
+@persistent
+def export_before_save(dummy):
+    """
+    Save handler: the results of the incremental updates are written once, when the file is saved.
+    While a background task runs, its worker may be modifying the state: the export is skipped,
+    the state stays dirty and is written at the next save.
+    """
+    if _STATE is None or not _STATE.dirty:
+        return
+    if background._CURRENT is not None:
+        print(f"Ownership not exported: '{background._CURRENT.label}' is running, it will be at the next save")
+        return
+    export_ownership(_STATE)
+
+
+def apply_ownership(state, empties, records, export=True):
+    """
+    Stores the records, writes the spot IDs, names each empty after its owner and sets its shape.
+    Generator yielding the fraction of the records applied so far.
+    If `export` is False, the text blocks are not rewritten: the state is only marked as dirty (see `export_ownership`).
+    """
+    for i, (index, spot_id, record) in enumerate(records):
+        empty = empties[index]
+        try:
+            current_name = empty.name
+        except ReferenceError: # The empty was deleted while the queries were running.
+            continue
+        if empty.get("spot_id") != spot_id:
+            empty["spot_id"] = spot_id
+        if record is not None:
+            state.record(spot_id, record)
+            name = record.owner + "-" + str(spot_id)
+            display = "SPHERE" if record.inside else "CUBE"
+            if current_name != name:
+                empty.name = name
+            if empty.empty_display_type != display:
+                empty.empty_display_type = display
+        yield (i + 1) / len(records)
+    state.dirty = True
+    if export:
+        export_ownership(state)
+
+
+def spot_to_closest_nucleus(incremental=False):
+    """
+    Loops through the spots (empties) and searches for the closest nucleus' surface.
+    Names each spot after its owner nucleus and sets its shape depending on whether it is inside or outside.
+    Counts the number of spots per nuclei ("Results_JSON"), and exports the signed distance,
+    the closest surface point and its normal for each spot ("Results_CSV").
+    In incremental mode, only the spots that could have changed owner since the last run are queried again,
+    and the results are not exported (see `export_ownership`), so updates stay cheap on large scenes.
+    Returns the number of spots that were queried.
+    """
+    prepared = prepare_ownership(incremental)
+    if prepared is None:
+        return 0
+    state, nuclei, empties, locations, ids = prepared
+    records = compute_ownership(state, nuclei, locations, ids)
+    for _ in apply_ownership(state, empties, records, export=not incremental):
+        pass
+    return len(records)
+
+
+def cloud_to_closest_nucleus(cloud):
+    """
+    Same as `spot_to_closest_nucleus`, for spots stored as the vertices of a point cloud (see `generate_spots`).
+    The owner (index in the "owner_names" custom property) and the signed distance of each spot
+    are stored as point attributes of the cloud, instead of renaming objects.
+    The spots are processed in batch (see `OwnershipState.closest_many`): no per-spot record or CSV line is produced,
+    only the counters ("Results_JSON").
+    Returns the owner and the signed distance of each spot, as arrays.
+    """
+    bpy.context.view_layer.update()
+    nuclei = get_nuclei()
+    if nuclei is None:
+        return None
+    state = OwnershipState()
+    state.update_nuclei(read_nuclei(nuclei))
+    names = state.spheres[0]
+
+    mesh = cloud.data
+    points = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", points)
+    matrix = np.array(cloud.matrix_world)
+    points = points.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+
+    owners, distances, inside = state.closest_many(points)
+    found = owners >= 0
+    signed = np.where(found, np.where(inside, -distances, distances), 0.0).astype(np.float32)
+
+    for attribute, kind, values in (("owner", 'INT', owners), ("signed_distance", 'FLOAT', signed)):
+        if attribute in mesh.attributes:
+            mesh.attributes.remove(mesh.attributes[attribute])
+        mesh.attributes.new(attribute, kind, 'POINT').data.foreach_set("value", values)
+    cloud["owner_names"] = names
+
+    n_in = np.bincount(owners[found & inside], minlength=len(names))
+    n_out = np.bincount(owners[found & ~inside], minlength=len(names))
+    counter_to_json({names[i]: {'in': int(n_in[i]), 'out': int(n_out[i])} for i in np.flatnonzero(n_in + n_out)})
+    return owners, signed
+
 
 if __name__ == "__main__":
     spot_to_closest_nucleus()
-
@@ -1,13 +1,80 @@
 import bpy
+import numpy as np
+import mathutils
 
-# Before launching this script, you need to have cut your touching objects ("Bissect" tool) and they must be ripped.
-
-def cut_and_close():
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.fill_holes(sides=1000)
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.separate(type='LOOSE')
-    bpy.ops.object.mode_set(mode='OBJECT')
-    bpy.ops.object.select_all(action='DESELECT')
\ No newline at end of file
+from .mesh_core import separate_nuclei
+
+# The cut, the closing of the holes and the separation are done on NumPy arrays (see `mesh_core`).
+# No edit-mode operator is involved, so it also works in background mode (blender -b).
+
+def mesh_to_arrays(mesh):
+    """
+    Returns the vertices (in local space) and the triangles of a Blender mesh as NumPy arrays.
+    N-gons are triangulated on the fly.
+    """
+    mesh.calc_loop_triangles()
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    faces = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("vertices", faces)
+    return vertices.reshape(-1, 3).astype(np.float64), faces.reshape(-1, 3).astype(np.int64)
+
+
+def arrays_to_object(name, vertices, faces, source):
+    """
+    Creates a new object from vertices and triangles arrays.
+    It is placed in the same collections and with the same transform as the `source` object.
+    """
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(vertices.tolist(), [], faces.tolist())
+    mesh.update()
+    obj = bpy.data.objects.new(name, mesh)
+    obj.matrix_world = source.matrix_world.copy()
+    for collection in source.users_collection:
+        collection.objects.link(obj)
+    return obj
+
+
+def cursor_plane(obj):
+    """
+    Returns the plane defined by the 3D cursor (its location and its local Z axis) in the object's local space.
+    """
+    cursor = bpy.context.scene.cursor
+    normal = cursor.matrix.to_3x3() @ mathutils.Vector((0.0, 0.0, 1.0))
+    origin = obj.matrix_world.inverted() @ cursor.location
+    normal = obj.matrix_world.to_3x3().transposed() @ normal
+    return np.array(origin), np.array(normal)
+
+
+def cut_and_close(objects=None, use_cursor=False):
+    """
+    Separates touching nuclei.
+    If `use_cursor` is True, the objects are cut along the plane of the 3D cursor.
+    Otherwise, the necks between nuclei are detected from the curvature and cut automatically.
+    The cuts are closed and each connected component becomes a new object.
+    The objects that didn't need to be separated are left untouched.
+    Returns the list of created objects.
+    """
+    if bpy.context.object is not None and bpy.context.object.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    if objects is None:
+        objects = bpy.context.selected_objects
+
+    created = []
+    for obj in [o for o in objects if o.type == 'MESH']:
+        vertices, faces = mesh_to_arrays(obj.data)
+        if use_cursor:
+            origin, normal = cursor_plane(obj)
+            components = separate_nuclei(vertices, faces, origin, normal)
+        else:
+            components = separate_nuclei(vertices, faces)
+        if len(components) < 2:
+            continue
+        for i, (c_vertices, c_faces) in enumerate(components):
+            created.append(arrays_to_object(f"{obj.name}-{i}", c_vertices, c_faces, obj))
+        bpy.data.objects.remove(obj, do_unlink=True)
+    return created
+
+
+if __name__ == "__main__":
+    cut_and_close()
@@ -1,6 +1,9 @@
 import bpy
 import bmesh
 
+from .cut_and_close import mesh_to_arrays
+from .mesh_core import mesh_volume
+
 ###############################################
 
 OPERATIONS = [
@@ -45,6 +48,30 @@ def find_objects_by_volume(collection_name, thr_volume, operation):
     
     select_items(targets)
 
+def collection_arrays(objects):
+    """
+    Returns the (name, vertices, faces) of each mesh among `objects` (e.g. `context.collection.objects`).
+    """
+    return [(obj.name, *mesh_to_arrays(obj.data)) for obj in objects if obj.type == 'MESH']
+
+def compute_volumes(meshes, task=None):
+    """
+    Computes the volume (in local space, like `bmesh.calc_volume`) of each (name, vertices, faces) tuple.
+    If a background task is provided, its progress is updated and the computation stops if it is cancelled.
+    Returns a dictionary: name -> volume.
+    """
+    volumes = {}
+    for i, (name, vertices, faces) in enumerate(meshes):
+        if task is not None and task.cancelled.is_set():
+            break
+        volumes[name] = abs(mesh_volume(vertices, faces))
+        if task is not None:
+            task.progress = (i + 1) / len(meshes)
+    return volumes
+
+def objects_in_range(volumes, vol_min, vol_max):
+    return [name for name, volume in volumes.items() if vol_min <= volume <= vol_max]
+
 if __name__ == "__main__":
     bpy.ops.object.select_all(action='DESELECT')
     find_objects_by_volume("Spots", 7.0, 'Smaller than')
@@ -0,0 +1,122 @@
+import bpy
+import numpy as np
+import mathutils
+
+from .spots_generator import uniform_spots, poisson_disk_spots
+from .closest_nuclei import OwnershipState, get_nuclei, read_nuclei
+
+# Replaces 'place_random_points.ijm': spots are created as coordinates, directly in Blender.
+# They are stored as the vertices of a single mesh (a point cloud), which stays fast with 10^5-10^6 spots.
+
+_LOCATIONS = "Spots-locations"
+_CLOUD     = "Spots-cloud"
+
+
+def nuclei_bounds(nuclei, margin=0.0):
+    """
+    Returns the lower and upper corners of the box containing all the nuclei (world space), enlarged by `margin`.
+    """
+    corners = np.array([obj.matrix_world @ mathutils.Vector(c) for obj in nuclei.values() for c in obj.bound_box])
+    return corners.min(axis=0) - margin, corners.max(axis=0) + margin
+
+
+def points_to_cloud(points, name=_CLOUD):
+    """
+    Creates (or replaces) a mesh object made only of vertices, one per spot.
+    It is placed in the 'Spots-locations' collection.
+    """
+    old = bpy.data.objects.get(name)
+    if old is not None:
+        bpy.data.objects.remove(old, do_unlink=True)
+    collection = bpy.data.collections.get(_LOCATIONS)
+    if collection is None:
+        collection = bpy.data.collections.new(_LOCATIONS)
+        bpy.context.scene.collection.children.link(collection)
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(points))
+    mesh.vertices.foreach_set("co", np.asarray(points, dtype=np.float32).ravel())
+    mesh.update()
+    cloud = bpy.data.objects.new(name, mesh)
+    collection.objects.link(cloud)
+    return cloud
+
+
+def _keep(state, points, constraint):
+    """
+    Mask of the points respecting the constraint ('INSIDE' or 'OUTSIDE' the nuclei).
+    Only the points inside a nucleus' bounding sphere are queried, the others are outside.
+    """
+    _, centers, radii = state.spheres
+    near = np.zeros(len(points), dtype=bool)
+    for center, radius in zip(centers, radii):
+        near |= np.sum((points - center) ** 2, axis=1) <= radius ** 2
+    inside = np.zeros(len(points), dtype=bool)
+    inside[near] = state.closest_many(points[near])[2]
+    return inside if constraint == 'INSIDE' else ~inside
+
+
+def generate_spots(n_spots, method='UNIFORM', radius=1.0, constraint='NONE', margin=5.0, seed=0):
+    """
+    Draws random spots in the box around the nuclei, and stores them in a point cloud.
+
+    Args:
+        - method (str): 'UNIFORM' or 'POISSON' (no two spots closer than `radius`).
+        - constraint (str): 'NONE', 'INSIDE' or 'OUTSIDE' (the nuclei). The margin is ignored for 'INSIDE'.
+        - seed (int): Seed of the random generator, the same seed produces the same spots.
+
+    Returns:
+        - The point cloud object.
+    """
+    nuclei = get_nuclei()
+    if not nuclei:
+        return None
+    lower, upper = nuclei_bounds(nuclei, 0.0 if constraint == 'INSIDE' else margin)
+    rng = np.random.default_rng(seed)
+    state = None
+    if constraint != 'NONE':
+        state = OwnershipState()
+        state.update_nuclei(read_nuclei(nuclei))
+
+    if method == 'POISSON':
+        # The fraction of the box respecting the constraint is estimated to know how many spots to draw.
+        fraction = 1.0 if state is None else max(np.mean(_keep(state, uniform_spots(2000, lower, upper, rng), constraint)), 1e-3)
+        points = poisson_disk_spots(int(1.5 * n_spots / fraction) + 1, lower, upper, radius, rng)
+        if state is not None:
+            points = points[_keep(state, points, constraint)]
+        points = points[:n_spots]
+    else:
+        batches = [np.zeros((0, 3))]
+        n_found, n_drawn = 0, 0
+        while n_found < n_spots:
+            fraction = 1.0 if n_drawn == 0 else n_found / n_drawn
+            if fraction == 0:
+                print("No spot respects the constraint")
+                break
+            n_draw = int(1.1 * (n_spots - n_found) / fraction) + 16
+            batch = uniform_spots(n_draw, lower, upper, rng)
+            if state is not None:
+                batch = batch[_keep(state, batch, constraint)]
+            batches.append(batch)
+            n_found += len(batch)
+            n_drawn += n_draw
+        points = np.concatenate(batches)[:n_spots]
+
+    print(f"{len(points)} spots generated")
+    return points_to_cloud(points)
+
+
+def import_spots(path):
+    """
+    Loads spots coordinates from a '.npy' file or a text file (CSV with x, y, z columns, optional header) into a point cloud.
+    """
+    if path.endswith(".npy"):
+        points = np.load(path)
+    else:
+        points = np.genfromtxt(path, delimiter=",", usecols=(0, 1, 2))
+        points = points[~np.any(np.isnan(points), axis=1)] # Header and invalid lines.
+    return points_to_cloud(points.reshape(-1, 3))
+
+
+if __name__ == "__main__":
+    generate_spots(100000)
@@ -0,0 +1,326 @@
+import numpy as np
+
+# This module only relies on NumPy, it doesn't import `bpy`.
+# It can be used from the addon, or headless (batch processing, tests, ...) on raw arrays:
+#   - vertices: (N, 3) float array
+#   - faces:    (M, 3) int array of vertex indices (triangles only)
+
+
+def face_normals(vertices, faces):
+    """
+    Returns the unit normal of each triangle.
+    Degenerate triangles get a null normal.
+    """
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(v1 - v0, v2 - v0)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+
+def _half_edges(faces):
+    """
+    Returns the half-edges (u -> v) of the triangles, the index of the face owning each of them,
+    and the vertex opposite to each half-edge in its face.
+    """
+    u = faces.ravel()
+    v = faces[:, [1, 2, 0]].ravel()
+    opposite = faces[:, [2, 0, 1]].ravel()
+    owner = np.repeat(np.arange(len(faces)), 3)
+    return u, v, owner, opposite
+
+
+def _edge_keys(u, v, n_vertices):
+    """Unique integer key of an undirected edge."""
+    return np.minimum(u, v).astype(np.int64) * n_vertices + np.maximum(u, v)
+
+
+def mesh_volume(vertices, faces):
+    """
+    Volume enclosed by a closed mesh (sum of the signed volumes of the tetrahedra formed with the origin).
+    """
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    return np.einsum('ij,ij->i', v0, np.cross(v1, v2)).sum() / 6.0
+
+
+def connected_labels(n_items, a, b):
+    """
+    Labels the connected components of a graph whose edges are given as two arrays of node indices.
+    Uses a min-label propagation with pointer jumping, so it only loops on the graph's diameter.
+    Returns an array of `n_items` labels, numbered from 0.
+    """
+    labels = np.arange(n_items)
+    if len(a) == 0:
+        return labels
+    while True:
+        smallest = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, smallest)
+        np.minimum.at(updated, b, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def vertex_curvature(vertices, faces, signed=True):
+    """
+    Angular curvature: for each vertex, it is the average of the dihedral angles over its incident edges.
+    If `signed`, angles are positive on convex edges and negative on concave ones (necks between touching nuclei).
+    Boundary edges count as flat.
+    """
+    n_vertices = len(vertices)
+    normals = face_normals(vertices, faces)
+    u, v, owner, opposite = _half_edges(faces)
+    keys = _edge_keys(u, v, n_vertices)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    # Manifold edges are the ones shared by exactly two consecutive half-edges once sorted.
+    paired = np.where(keys[:-1] == keys[1:])[0]
+    h1, h2 = order[paired], order[paired + 1]
+    n1, n2 = normals[owner[h1]], normals[owner[h2]]
+    angles = np.arccos(np.clip(np.einsum('ij,ij->i', n1, n2), -1.0, 1.0))
+    if signed:
+        # The edge is concave if the opposite vertex of the second face is above the plane of the first one.
+        above = np.einsum('ij,ij->i', vertices[opposite[h2]] - vertices[u[h1]], n1)
+        angles[above > 0] *= -1.0
+
+    unique_keys = np.unique(keys)
+    n_edges = np.bincount(np.concatenate([unique_keys // n_vertices, unique_keys % n_vertices]), minlength=n_vertices)
+    angle_sum = np.bincount(u[h1], weights=angles, minlength=n_vertices)
+    angle_sum += np.bincount(v[h1], weights=angles, minlength=n_vertices)
+    return np.divide(angle_sum, n_edges, out=np.zeros(n_vertices), where=n_edges > 0)
+
+
+def smooth_vertex_values(values, faces, iterations=2):
+    """
+    Averages a per-vertex value with the values of the neighbors, `iterations` times.
+    """
+    u, v, _, _ = _half_edges(faces)
+    n_vertices = len(values)
+    # Each edge is seen from both sides on a closed mesh: the vertex itself counts as much as its neighbors.
+    weights = np.bincount(u, minlength=n_vertices) + 1.0
+    for _ in range(iterations):
+        values = (values + np.bincount(u, weights=values[v], minlength=n_vertices)) / weights
+    return values
+
+
+def _fit_plane(points):
+    """
+    Fits a plane through points (PCA: the normal is the direction of least variance).
+    Returns the origin, the normal and the radius of the region to cut.
+    """
+    origin = points.mean(axis=0)
+    _, eigen_vectors = np.linalg.eigh(np.cov((points - origin).T))
+    radius = 1.5 * np.max(np.linalg.norm(points - origin, axis=1))
+    return origin, eigen_vectors[:, 0], radius
+
+
+def _merge_neck_pieces(clusters, angle=20.0, tolerance=0.25):
+    """
+    Merges the clusters of neck vertices that are pieces of the same neck ring. Two clusters are merged if:
+        - they are adjacent: the gap between them is smaller than the radius of one of them,
+        - or they are coplanar: their planes are parallel (up to `angle` degrees),
+          close along the normal (`tolerance` x radius) and their regions overlap.
+    Returns the list of merged clusters (arrays of points).
+    """
+    planes = [_fit_plane(points) for points in clusters]
+    a, b = [], []
+    for i, (o1, n1, r1) in enumerate(planes):
+        for j in range(i + 1, len(planes)):
+            o2, n2, r2 = planes[j]
+            gap = np.min(np.linalg.norm(clusters[i][:, np.newaxis] - clusters[j][np.newaxis], axis=2))
+            parallel = abs(np.dot(n1, n2)) > np.cos(np.radians(angle))
+            offset = max(abs(np.dot(o2 - o1, n1)), abs(np.dot(o2 - o1, n2)))
+            coplanar = parallel and offset < tolerance * max(r1, r2) and np.linalg.norm(o2 - o1) < r1 + r2
+            if gap < max(r1, r2) or coplanar:
+                a.append(i)
+                b.append(j)
+    labels = connected_labels(len(clusters), np.array(a, dtype=np.int64), np.array(b, dtype=np.int64))
+    return [np.concatenate([c for c, l in zip(clusters, labels) if l == label]) for label in range(labels.max() + 1)]
+
+
+def find_necks(vertices, faces, curvature=None, threshold=None, min_size=12, smoothing=2):
+    """
+    Detects the necks between touching nuclei as clusters of strongly concave vertices.
+    A plane is fitted through each cluster (PCA: the normal is the direction of least variance).
+
+    Args:
+        - curvature (np.array): Per-vertex signed curvature, computed with `vertex_curvature` if not provided.
+        - threshold (float): A vertex belongs to a neck if its curvature is below `-threshold`.
+                             By default, the median of the absolute curvature is used.
+        - min_size (int): Clusters with fewer vertices are considered as noise.
+        - smoothing (int): Iterations of averaging of the curvature (see `smooth_vertex_values`).
+                           It removes the alternating concave/convex edges of the staircases produced by marching cubes.
+
+    Returns:
+        - A list of (origin, normal, radius) tuples, one per neck.
+          Pieces of the same neck ring (adjacent or coplanar clusters) are merged in a single cut.
+    """
+    if curvature is None:
+        curvature = vertex_curvature(vertices, faces)
+    if smoothing > 0:
+        curvature = smooth_vertex_values(curvature, faces, smoothing)
+    if threshold is None:
+        threshold = np.median(np.abs(curvature))
+    is_neck = curvature < -threshold
+    if not np.any(is_neck):
+        return []
+
+    u, v, _, _ = _half_edges(faces)
+    both = is_neck[u] & is_neck[v]
+    labels = connected_labels(len(vertices), u[both], v[both])
+    clusters = [vertices[(labels == label) & is_neck] for label in np.unique(labels[is_neck])]
+    # Isolated vertices can't define a plane, they are discarded before merging.
+    clusters = [points for points in clusters if len(points) >= 3]
+    if len(clusters) == 0:
+        return []
+    return [_fit_plane(points) for points in _merge_neck_pieces(clusters) if len(points) >= min_size]
+
+
+def cut_by_plane(vertices, faces, origin, normal, radius=None):
+    """
+    Clips the triangles crossing a plane, and rips the mesh along the cut.
+    The intersection points are duplicated so each side of the plane gets its own boundary loop.
+
+    Args:
+        - origin (np.array): A point of the plane.
+        - normal (np.array): The normal of the plane (doesn't have to be normalized).
+        - radius (float): If provided, only the triangles whose centroid is closer than `radius` to `origin` are cut.
+                          It allows to cut a neck without slicing through the rest of the object.
+
+    Returns:
+        - The new (vertices, faces) arrays. The original vertices keep their indices.
+    """
+    normal = np.asarray(normal, dtype=np.float64)
+    normal = normal / np.linalg.norm(normal)
+    distances = (vertices - origin) @ normal
+    distances[distances == 0] = 1e-12 # Vertices on the plane are considered on the positive side.
+    positive = distances > 0
+
+    n_positive = positive[faces].sum(axis=1)
+    crossing = (n_positive == 1) | (n_positive == 2)
+    if radius is not None:
+        centroids = vertices[faces].mean(axis=1)
+        crossing &= np.linalg.norm(centroids - origin, axis=1) < radius
+    if not np.any(crossing):
+        return vertices, faces
+
+    # Rotates each crossing triangle (keeping its winding) so its lonely vertex comes first.
+    cut = faces[crossing]
+    side = positive[cut]
+    lonely = np.where(n_positive[crossing] == 1, np.argmax(side, axis=1), np.argmin(side, axis=1))
+    rotation = (lonely[:, np.newaxis] + np.arange(3)) % 3
+    a, b, c = np.take_along_axis(cut, rotation, axis=1).T
+
+    # Intersection points, shared by the triangles having the same edge.
+    n_vertices = len(vertices)
+    keys, inverse = np.unique(np.concatenate([_edge_keys(a, b, n_vertices), _edge_keys(a, c, n_vertices)]), return_inverse=True)
+    e0, e1 = keys // n_vertices, keys % n_vertices
+    t = distances[e0] / (distances[e0] - distances[e1])
+    points = vertices[e0] + t[:, np.newaxis] * (vertices[e1] - vertices[e0])
+    p_ab, p_ac = np.split(inverse, 2)
+
+    # Each side gets its own copy of the intersection points.
+    n_points = len(points)
+    lonely_positive = positive[a]
+    lonely_offset = np.where(lonely_positive, n_vertices, n_vertices + n_points)
+    others_offset = np.where(lonely_positive, n_vertices + n_points, n_vertices)
+    lonely_faces = np.stack([a, p_ab + lonely_offset, p_ac + lonely_offset], axis=1)
+    others_faces = np.concatenate([
+        np.stack([p_ab + others_offset, b, c], axis=1),
+        np.stack([p_ab + others_offset, c, p_ac + others_offset], axis=1)
+    ])
+
+    new_vertices = np.concatenate([vertices, points, points])
+    new_faces = np.concatenate([faces[~crossing], lonely_faces, others_faces])
+    return remove_unreferenced_vertices(new_vertices, new_faces)
+
+
+def remove_unreferenced_vertices(vertices, faces):
+    """
+    Drops the vertices that are not used by any face.
+    The kept vertices are stored in their original order.
+    """
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.ravel()] = True
+    if np.all(used):
+        return vertices, faces
+    remap = np.cumsum(used) - 1
+    return vertices[used], remap[faces]
+
+
+def cap_boundary_loops(vertices, faces):
+    """
+    Closes every boundary loop of the mesh with a fan of triangles around the loop's centroid.
+    Loops don't need to be ordered: each boundary half-edge (u -> v) produces the triangle (v, u, centroid),
+    so the winding of the cap is consistent with the rest of the mesh.
+    This is the equivalent of `fill_holes` + `quads_convert_to_tris` for planar cuts.
+    """
+    u, v, _, _ = _half_edges(faces)
+    keys = _edge_keys(u, v, len(vertices))
+    unique_keys, counts = np.unique(keys, return_counts=True)
+    is_boundary = np.isin(keys, unique_keys[counts == 1])
+    if not np.any(is_boundary):
+        return vertices, faces
+    u, v = u[is_boundary], v[is_boundary]
+
+    # Loops are the connected components of the boundary edges.
+    boundary_vertices, compact = np.unique(np.concatenate([u, v]), return_inverse=True)
+    cu, cv = np.split(compact, 2)
+    labels = connected_labels(len(boundary_vertices), cu, cv)
+    n_loops = labels.max() + 1
+    counts = np.bincount(labels, minlength=n_loops)[:, np.newaxis]
+    centroids = np.stack([
+        np.bincount(labels, weights=vertices[boundary_vertices, i], minlength=n_loops) for i in range(3)
+    ], axis=1) / counts
+
+    centers = len(vertices) + labels[cu]
+    caps = np.stack([v, u, centers], axis=1)
+    return np.concatenate([vertices, centroids]), np.concatenate([faces, caps])
+
+
+def split_components(vertices, faces):
+    """
+    Splits a mesh in its connected components.
+    Loose vertices (not used by any face) are dropped, they don't make components.
+    Returns a list of (vertices, faces) tuples, one per component.
+    """
+    if len(faces) == 0:
+        return []
+    u, v, _, _ = _half_edges(faces)
+    labels = connected_labels(len(vertices), u, v)
+    # Labels are renumbered over the faces, so a label without faces doesn't produce an empty component.
+    face_labels = np.unique(labels[faces[:, 0]], return_inverse=True)[1].ravel()
+    order = np.argsort(face_labels, kind='stable')
+    bounds = np.searchsorted(face_labels[order], np.arange(1, face_labels.max() + 1))
+    components = []
+    for component_faces in np.split(faces[order], bounds):
+        used, remap = np.unique(component_faces, return_inverse=True)
+        components.append((vertices[used], remap.reshape(-1, 3)))
+    return components
+
+
+def separate_nuclei(vertices, faces, origin=None, normal=None, min_faces=32, min_volume=0.01, **neck_options):
+    """
+    Cuts a mesh made of touching nuclei, closes the cuts and splits it in connected components.
+    If a plane (`origin`, `normal`) is provided, the whole mesh is cut along it.
+    Otherwise, the necks are detected from the curvature (see `find_necks`) and each of them is cut locally.
+    Degenerate components (slivers left by a cut) are dropped: the ones with less than `min_faces` faces,
+    or whose volume is below `min_volume` times the volume of the whole mesh.
+
+    Returns:
+        - A list of (vertices, faces) tuples, one per separated object.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    if origin is not None and normal is not None:
+        planes = [(np.asarray(origin, dtype=np.float64), normal, None)]
+    else:
+        planes = find_necks(vertices, faces, **neck_options)
+    for p_origin, p_normal, radius in planes:
+        vertices, faces = cut_by_plane(vertices, faces, p_origin, p_normal, radius)
+    vertices, faces = cap_boundary_loops(vertices, faces)
+    components = split_components(vertices, faces)
+    total = sum(abs(mesh_volume(v, f)) for v, f in components)
+    return [(v, f) for v, f in components if len(f) >= min_faces and abs(mesh_volume(v, f)) >= min_volume * total]
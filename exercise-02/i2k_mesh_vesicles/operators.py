@@ -0,0 +1,310 @@
+import bpy
+
+from .random_color import random_lut
+from .split_components import split_components
+from .spots_to_empties import reset_locations, spots_as_empties
+from .cut_and_close import cut_and_close
+from .closest_nuclei import mark_edited_nuclei, cloud_to_closest_nucleus
+from .closest_nuclei import prepare_ownership, compute_ownership, apply_ownership, reset_ownership, export_ownership, export_before_save
+from .generate_spots import generate_spots, import_spots
+from .filter_by_volume import find_objects_by_volume, collection_arrays, compute_volumes, objects_in_range
+from .process_curvature import nuclei_arrays, compute_curvatures, write_curvature
+from . import background
+from .background import BackgroundOperator, OBJECT_OT_cancel_background_task, draw_progress
+
+CUT_PLANES = [
+    ('NECKS', "Detect necks", "Cut where the curvature shows a neck between two nuclei"),
+    ('CURSOR', "3D cursor", "Cut along the XY plane of the 3D cursor"),
+]
+
+### > Functions call have to be done wrapped in an operator.
+
+class OBJECT_OT_split_connected_components(bpy.types.Operator):
+    bl_idname = "object.split_connected_components"
+    bl_label = "Split connected components"
+    bl_description = "Split the selected mesh in connected components"
+    
+    def execute(self, context):
+        # split_components()
+        self.report({'INFO'}, "Splitting connected components")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_random_color(bpy.types.Operator):
+    bl_idname = "object.random_color"
+    bl_label = "Random color"
+    bl_description = "Apply a random color to the selected mesh"
+
+    def execute(self, context):
+        collection = bpy.context.collection
+        # random_lut(collection)
+        self.report({'INFO'}, "Applying random color")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_close_cut(bpy.types.Operator):
+    bl_idname = "object.close_cut"
+    bl_label = "Close cut"
+    bl_description = "Cut touching nuclei (along the 3D cursor's plane or at the detected necks), close the cuts and split new objects"
+
+    cut_plane: bpy.props.EnumProperty(
+        name="Cut plane",
+        items=CUT_PLANES,
+        default='NECKS'
+    )
+
+    def execute(self, context):
+        created = cut_and_close(use_cursor=(self.cut_plane == 'CURSOR'))
+        self.report({'INFO'}, f"Separating nuclei: {len(created)} objects created")
+        return {'FINISHED'}
+
+# Wrapper pour "Select by volume"
+class OBJECT_OT_select_by_volume(BackgroundOperator, bpy.types.Operator):
+    bl_idname = "object.select_by_volume"
+    bl_label = "Select by volume"
+    bl_description = "Select objects by volume"
+
+    volume_min: bpy.props.FloatProperty(name="Volume Min", default=0.0)
+    volume_max: bpy.props.FloatProperty(name="Volume Max", default=100.0)
+
+    def prepare(self, context):
+        if context.object is not None and context.object.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        return collection_arrays(context.collection.objects)
+
+    def compute(self, meshes, task):
+        return compute_volumes(meshes, task)
+
+    def apply(self, context, volumes):
+        bpy.ops.object.select_all(action='DESELECT')
+        targets = objects_in_range(volumes, self.volume_min, self.volume_max)
+        for i, name in enumerate(targets):
+            obj = bpy.data.objects.get(name)
+            if obj is not None:
+                obj.select_set(True)
+            yield (i + 1) / len(targets)
+        self.report({'INFO'}, f"Selected {len(targets)} objects with volume between {self.volume_min} and {self.volume_max}")
+
+
+class OBJECT_OT_spots_as_empties(bpy.types.Operator):
+    bl_idname = "object.spots_as_empties"
+    bl_label = "Spots as empties"
+    bl_description = "Create empties at spots locations"
+
+    def execute(self, context):
+        # reset_locations()
+        # spots_as_empties()
+        self.report({'INFO'}, "Creating spots as empties")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_spots_ownership(BackgroundOperator, bpy.types.Operator):
+    bl_idname = "object.spots_ownership"
+    bl_label = "Spots ownership"
+    bl_description = "Determine by which nucleus is owned each spot"
+
+    incremental: bpy.props.BoolProperty(
+        name="Incremental",
+        description="Only process the spots that could have changed owner since the last run",
+        default=False
+    )
+
+    def prepare(self, context):
+        return prepare_ownership(self.incremental)
+
+    def compute(self, prepared, task):
+        if prepared is None:
+            return None
+        state, nuclei, empties, locations, ids = prepared
+        return state, empties, compute_ownership(state, nuclei, locations, ids, task)
+
+    def apply(self, context, result):
+        if result is None:
+            self.report({'WARNING'}, "No nuclei or no spots to process")
+            return
+        state, empties, records = result
+        yield from apply_ownership(state, empties, records, export=not self.incremental)
+        self.report({'INFO'}, f"Managing spots ownership: {len(records)} spots processed")
+
+    def on_cancel(self, context):
+        # The state may be partially updated: the next incremental run starts from scratch.
+        reset_ownership()
+
+
+class OBJECT_OT_export_ownership(bpy.types.Operator):
+    bl_idname = "object.export_ownership"
+    bl_label = "Export ownership"
+    bl_description = "Write the spots count and the per-spot metrics of the last ownership run in the 'Results_JSON' and 'Results_CSV' texts"
+
+    def execute(self, context):
+        if background._CURRENT is not None:
+            self.report({'WARNING'}, f"Wait for '{background._CURRENT.label}' to finish, or cancel it")
+            return {'CANCELLED'}
+        if not export_ownership():
+            self.report({'WARNING'}, "Run the spots ownership first")
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Exported spots ownership")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_generate_spots(bpy.types.Operator):
+    bl_idname = "object.generate_spots"
+    bl_label = "Generate spots"
+    bl_description = "Create random spots around the nuclei as a point cloud, and process their ownership"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    n_spots: bpy.props.IntProperty(name="Number of spots", default=10000, min=1)
+    method: bpy.props.EnumProperty(
+        name="Method",
+        items=[
+            ('UNIFORM', "Uniform", "Spots are drawn uniformly"),
+            ('POISSON', "Poisson disk", "No two spots are closer than the radius"),
+        ],
+        default='UNIFORM'
+    )
+    radius: bpy.props.FloatProperty(name="Radius", default=1.0, min=0.0001)
+    constraint: bpy.props.EnumProperty(
+        name="Constraint",
+        items=[
+            ('NONE', "None", "Spots can be anywhere"),
+            ('INSIDE', "Inside", "Spots are inside the nuclei"),
+            ('OUTSIDE', "Outside", "Spots are outside the nuclei"),
+        ],
+        default='NONE'
+    )
+    seed: bpy.props.IntProperty(name="Seed", default=0, min=0)
+    ownership: bpy.props.BoolProperty(name="Process ownership", default=True)
+
+    def execute(self, context):
+        cloud = generate_spots(self.n_spots, self.method, self.radius, self.constraint, seed=self.seed)
+        if cloud is None:
+            self.report({'WARNING'}, "No nuclei to place spots around")
+            return {'CANCELLED'}
+        if self.ownership:
+            cloud_to_closest_nucleus(cloud)
+        self.report({'INFO'}, f"Generated {len(cloud.data.vertices)} spots")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_import_spots(bpy.types.Operator):
+    bl_idname = "object.import_spots"
+    bl_label = "Import spots"
+    bl_description = "Load spots coordinates (.npy or .csv) as a point cloud, and process their ownership"
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        cloud = import_spots(self.filepath)
+        cloud_to_closest_nucleus(cloud)
+        self.report({'INFO'}, f"Imported {len(cloud.data.vertices)} spots")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_nuclei_curvature(BackgroundOperator, bpy.types.Operator):
+    bl_idname = "object.nuclei_curvature"
+    bl_label = "Nuclei curvature"
+    bl_description = "Process the local vertex curvature of the nuclei"
+
+    def prepare(self, context):
+        if context.object is not None and context.object.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        return nuclei_arrays()
+
+    def compute(self, meshes, task):
+        return compute_curvatures(meshes, task)
+
+    def apply(self, context, curvatures):
+        for i, (name, curvature) in enumerate(curvatures):
+            obj = bpy.data.objects.get(name)
+            # The mesh may have been deleted or edited while the curvature was computed.
+            if obj is not None and len(obj.data.vertices) == len(curvature):
+                write_curvature(obj, curvature)
+            yield (i + 1) / len(curvatures)
+        self.report({'INFO'}, "Produced vertex attribute")
+
+
+# We make our panel (looking like a tab) in the viewer's side panel 
+# (the one that you can open with N)
+class VIEW3D_PT_vesicles_tools_panel(bpy.types.Panel):
+    bl_label = "Vesicles tools"
+    bl_idname = "VIEW3D_PT_vesicles_tools_panel"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Vesicles Tools'
+    
+    def draw(self, context):
+        layout = self.layout
+        draw_progress(layout)
+        
+        layout.operator("object.split_connected_components", text="Split connected components")
+        layout.operator("object.random_color", text="Random color")
+        layout.prop(context.scene, "cut_plane", text="Cut plane")
+        op = layout.operator("object.close_cut", text="Close cut")
+        op.cut_plane = context.scene.cut_plane
+        
+        layout.prop(context.scene, "volume_min", text="Volume Min")
+        layout.prop(context.scene, "volume_max", text="Volume Max")
+        op = layout.operator("object.select_by_volume", text="Select by volume")
+        op.volume_min = context.scene.volume_min
+        op.volume_max = context.scene.volume_max
+        
+        layout.operator("object.spots_as_empties", text="Spots as empties")
+        layout.operator("object.spots_ownership", text="Spots ownership")
+        op = layout.operator("object.spots_ownership", text="Update ownership")
+        op.incremental = True
+        layout.operator("object.export_ownership", text="Export ownership")
+        layout.operator("object.generate_spots", text="Generate spots")
+        layout.operator("object.import_spots", text="Import spots")
+        layout.operator("object.nuclei_curvature", text="Nuclei curvature")
+
+
+# In Blender, you need to register your classes if you want them to be loaded in the pool of operators.
+def register_props():
+    bpy.types.Scene.volume_min = bpy.props.FloatProperty(name="Volume Min", default=0.0)
+    bpy.types.Scene.volume_max = bpy.props.FloatProperty(name="Volume Max", default=1.0)
+    bpy.types.Scene.cut_plane = bpy.props.EnumProperty(
+        name="Cut plane",
+        items=CUT_PLANES,
+        default='NECKS'
+    )
+
+def unregister_props():
+    del bpy.types.Scene.volume_min
+    del bpy.types.Scene.volume_max
+    del bpy.types.Scene.cut_plane
+
+# Enregistrement des classes
+classes = (
+    OBJECT_OT_split_connected_components,
+    OBJECT_OT_random_color,
+    OBJECT_OT_close_cut,
+    OBJECT_OT_select_by_volume,
+    OBJECT_OT_spots_as_empties,
+    OBJECT_OT_spots_ownership,
+    OBJECT_OT_export_ownership,
+    OBJECT_OT_generate_spots,
+    OBJECT_OT_import_spots,
+    OBJECT_OT_nuclei_curvature,
+    OBJECT_OT_cancel_background_task,
+    VIEW3D_PT_vesicles_tools_panel
+)
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+    register_props()
+    bpy.app.handlers.depsgraph_update_post.append(mark_edited_nuclei)
+    bpy.app.handlers.save_pre.append(export_before_save)
+
+def unregister():
+    for cls in classes:
+        bpy.utils.unregister_class(cls)
+    unregister_props()
+    if mark_edited_nuclei in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(mark_edited_nuclei)
+    if export_before_save in bpy.app.handlers.save_pre:
+        bpy.app.handlers.save_pre.remove(export_before_save)
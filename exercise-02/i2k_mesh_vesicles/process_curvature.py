@@ -1,44 +1,57 @@
 import bpy
-import bmesh
-import mathutils
+import numpy as np
 
-def _process_curvature(obj, attribute_name):
+from .cut_and_close import mesh_to_arrays
+from .mesh_core import vertex_curvature
+
+ATTRIBUTE_NAME = "vertex_curvature"
+
+# The curvature is computed on NumPy arrays (see `mesh_core.vertex_curvature`, unsigned version):
+# for each vertex, the average angle between the normals of the faces on each side of its edges.
+# Reading the meshes and writing the attributes are separated from the computation,
+# so the computation can run in a background thread (see the 'Nuclei curvature' operator).
+
+def nuclei_arrays():
+    """
+    Returns the (name, vertices, faces) of each mesh of the 'Nuclei' collection.
+    """
+    return [(obj.name, *mesh_to_arrays(obj.data)) for obj in bpy.data.collections['Nuclei'].objects if obj.type == 'MESH']
+
+
+def compute_curvatures(meshes, task=None):
+    """
+    Computes the curvature of each (name, vertices, faces) tuple.
+    If a background task is provided, its progress is updated and the computation stops if it is cancelled.
+    Returns a list of (name, curvature) tuples.
+    """
+    results = []
+    for i, (name, vertices, faces) in enumerate(meshes):
+        if task is not None and task.cancelled.is_set():
+            break
+        results.append((name, vertex_curvature(vertices, faces, signed=False)))
+        if task is not None:
+            task.progress = (i + 1) / len(meshes)
+    return results
+
+
+def write_curvature(obj, curvature, attribute_name=ATTRIBUTE_NAME):
+    """
+    Stores the curvature as a float attribute on the vertices of the object.
+    """
     mesh = obj.data
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-
-    if bm.verts.layers.float.get(attribute_name):
-        curvature_layer = bm.verts.layers.float[attribute_name]
-    else:
-        curvature_layer = bm.verts.layers.float.new(attribute_name)
-    
-    for vert in bm.verts:
-        if len(vert.link_edges) == 0:
-            continue
-        angle_sum = 0.0
-        for edge in vert.link_edges:
-            faces = edge.link_faces
-            if len(faces) == 2:
-                normal1 = faces[0].normal
-                normal2 = faces[1].normal
-                angle = normal1.angle(normal2)
-                angle_sum += angle
-
-        avg_curvature = angle_sum / len(vert.link_edges)
-        vert[curvature_layer] = avg_curvature
-    
-    bm.to_mesh(mesh)
-    bm.free()
+    attribute = mesh.attributes.get(attribute_name)
+    if attribute is None:
+        attribute = mesh.attributes.new(attribute_name, 'FLOAT', 'POINT')
+    attribute.data.foreach_set("value", curvature.astype(np.float32))
     mesh.update()
 
+
 def process_curvature():
-    attribute_name = "vertex_curvature"
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for obj in bpy.data.collections['Nuclei'].objects:
-        if obj.type != 'MESH':
-            continue
-        _process_curvature(obj, attribute_name)
+    if bpy.context.object is not None:
+        bpy.ops.object.mode_set(mode='OBJECT')
+    for name, curvature in compute_curvatures(nuclei_arrays()):
+        write_curvature(bpy.data.objects[name], curvature)
 
 
 if __name__ == "__main__":
-    process_curvature()
\ No newline at end of file
+    process_curvature()
@@ -0,0 +1,130 @@
+import numpy as np
+
+# Generation of spots as coordinates arrays, without going through images, labels and meshes.
+# Like `mesh_core`, this module only relies on NumPy and can be used outside of Blender.
+
+
+def uniform_spots(n_spots, lower, upper, seed=None):
+    """
+    Draws `n_spots` points uniformly in the box [lower, upper].
+    Returns a (n_spots, 3) float array.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.uniform(lower, upper, size=(n_spots, 3))
+
+
+def _cell_keys(cells, dims):
+    """Unique integer key of each grid cell, -1 for the cells out of the grid."""
+    inside = np.all((cells >= 0) & (cells < dims), axis=1)
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    return np.where(inside, keys, -1)
+
+
+def _too_close(points, cells, ref_points, ref_keys, ref_order, dims, radius, offsets):
+    """
+    For each point, checks whether a reference point lies closer than `radius`.
+    References are stored in a sparse grid: their sorted cell keys, and the order sorting them.
+    Points should be sorted by cell key: the searches are then done on sorted keys, which is much faster.
+    """
+    close = np.zeros(len(points), dtype=bool)
+    if len(ref_keys) == 0:
+        return close
+    for offset in offsets:
+        keys = _cell_keys(cells + offset, dims)
+        positions = np.minimum(np.searchsorted(ref_keys, keys), len(ref_keys) - 1)
+        found = (keys >= 0) & (ref_keys[positions] == keys)
+        neighbors = ref_points[ref_order[positions[found]]]
+        close[found] |= np.linalg.norm(points[found] - neighbors, axis=1) < radius
+    return close
+
+
+def _resolve_conflicts(points, cells, keys, ranks, dims, radius, offsets):
+    """
+    Selects, among candidates sorted by cell key (at most one per cell), the ones a sequential drawing would keep:
+    a candidate is kept if no candidate drawn before it (lower rank) and kept is closer than `radius`.
+    It is solved by rounds: a candidate is kept once all its earlier conflicting candidates are rejected,
+    and rejected as soon as one of them is kept.
+    """
+    if len(points) == 0:
+        return np.zeros(0, dtype=bool)
+    a, b = [], []
+    for offset in offsets:
+        n_keys = _cell_keys(cells + offset, dims)
+        positions = np.minimum(np.searchsorted(keys, n_keys), len(keys) - 1)
+        found = (n_keys >= 0) & (keys[positions] == n_keys)
+        idx = np.flatnonzero(found)
+        others = positions[found]
+        conflict = (ranks[others] < ranks[idx]) & (np.linalg.norm(points[idx] - points[others], axis=1) < radius)
+        a.append(idx[conflict])
+        b.append(others[conflict])
+    later, earlier = np.concatenate(a), np.concatenate(b)
+
+    UNDECIDED, KEPT, REJECTED = 0, 1, 2
+    status = np.zeros(len(points), dtype=np.int8)
+    while True:
+        undecided = status == UNDECIDED
+        if not np.any(undecided):
+            break
+        # Rejected: an earlier conflicting candidate is kept.
+        rejected = np.zeros(len(points), dtype=bool)
+        rejected[later[status[earlier] == KEPT]] = True
+        # Kept: all the earlier conflicting candidates are rejected.
+        waiting = np.zeros(len(points), dtype=bool)
+        waiting[later[status[earlier] != REJECTED]] = True
+        status[undecided & rejected] = REJECTED
+        status[undecided & ~rejected & ~waiting] = KEPT
+    return status == KEPT
+
+
+def poisson_disk_spots(n_spots, lower, upper, radius, seed=None, max_rounds=50):
+    """
+    Draws up to `n_spots` points in the box [lower, upper], no two of them being closer than `radius`.
+    Candidates are thrown by batches and tested against a sparse grid whose cells (of size radius/sqrt(3))
+    contain at most one point, so only the 5x5x5 neighboring cells have to be checked.
+    A batch is never larger than the number of cells, and its conflicts are resolved as if its candidates
+    were drawn one by one (see `_resolve_conflicts`): asking for more spots never returns fewer.
+    If the box is too small for the requested number of points, fewer points are returned:
+    the drawing stops when a batch adds less than 1% of its candidates (the box is almost saturated).
+    """
+    rng = np.random.default_rng(seed)
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+    cell = radius / np.sqrt(3.0)
+    dims = np.floor((upper - lower) / cell).astype(np.int64) + 1
+    n_cells = int(np.prod(dims))
+    offsets = np.stack(np.meshgrid(*[np.arange(-2, 3)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    accepted = np.zeros((0, 3))
+    keys = np.zeros(0, dtype=np.int64)
+    order = np.zeros(0, dtype=np.int64)
+    for _ in range(max_rounds):
+        missing = n_spots - len(accepted)
+        if missing <= 0:
+            break
+        n_candidates = min(max(2 * missing, 1024), n_cells)
+        candidates = rng.uniform(lower, upper, size=(n_candidates, 3))
+        cells = np.floor((candidates - lower) / cell).astype(np.int64)
+        # Candidates are sorted by cell, their drawing rank gives their priority.
+        c_keys = _cell_keys(cells, dims)
+        ranks = np.argsort(c_keys, kind='stable')
+        candidates, cells, c_keys = candidates[ranks], cells[ranks], c_keys[ranks]
+        free = ~_too_close(candidates, cells, accepted, keys, order, dims, radius, offsets)
+        candidates, cells, c_keys, ranks = candidates[free], cells[free], c_keys[free], ranks[free]
+
+        # A cell can't hold two points: the first candidate drawn in each cell is kept,
+        # then the conflicts with the neighboring cells are resolved in drawing order.
+        first = np.concatenate([[True], c_keys[1:] != c_keys[:-1]])[:len(c_keys)]
+        candidates, cells, c_keys, ranks = candidates[first], cells[first], c_keys[first], ranks[first]
+        kept = _resolve_conflicts(candidates, cells, c_keys, ranks, dims, radius, offsets)
+        candidates, ranks = candidates[kept], ranks[kept]
+        candidates = candidates[np.argsort(ranks)][:missing]
+
+        accepted = np.concatenate([accepted, candidates])
+        if len(candidates) < 0.01 * n_candidates:
+            break
+        all_keys = _cell_keys(np.floor((accepted - lower) / cell).astype(np.int64), dims)
+        order = np.argsort(all_keys, kind='stable')
+        keys = all_keys[order]
+    if len(accepted) < n_spots:
+        print(f"Only {len(accepted)} spots could be placed with a radius of {radius}")
+    return accepted
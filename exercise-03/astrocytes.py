@@ -1,8 +1,14 @@
 import napari
 import open3d as o3d
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
 import os
 import math
+import time
+import hashlib
 
 
 def isSmall(e):
@@ -19,6 +25,47 @@ def makeSourceName(name):
     return os.path.basename(name).split('.')[0]
 
 
+def make_lut(*colors, size=256):
+    """Builds a lookup table (size x 3, float32) interpolating linearly between the given RGB colors."""
+    colors = np.asarray(colors, dtype=np.float32)
+    steps = np.linspace(0.0, 1.0, size)
+    anchors = np.linspace(0.0, 1.0, len(colors))
+    return np.stack([np.interp(steps, anchors, colors[:, c]) for c in range(3)], axis=1).astype(np.float32)
+
+
+# Lookup tables used to turn scalar fields into colors.
+COLORMAPS = {
+    'gray': make_lut((0, 0, 0), (1, 1, 1)),
+    'red': make_lut((0, 0, 0), (1, 0, 0)),
+    'exterior': make_lut((0.75, 0.75, 0.75), (1, 0, 0)),
+    'heat': make_lut((0, 0, 0.5), (0, 0.8, 1), (1, 1, 0), (1, 0, 0)),
+    'labels': np.random.default_rng(0).random((256, 3)).astype(np.float32)
+}
+
+# Gray used for the vertices without label.
+BACKGROUND = np.float32(0.75)
+
+
+def map_to_colors(values, kind, colormap, percentiles=(1, 99)):
+    """
+    Maps a scalar field to RGB colors (float32) through a lookup table.
+
+    Args:
+        - kind (str): 'scalar' values are normalized between the given percentiles,
+                      'flag' values are already between 0 and 1,
+                      'label' values are IDs (-1 for no label), colored by cycling through the table.
+    """
+    lut = COLORMAPS[colormap]
+    if kind == 'label':
+        colors = lut[np.mod(values, len(lut))]
+        colors[values < 0] = BACKGROUND
+        return colors
+    low, high = np.percentile(values, percentiles) if kind == 'scalar' else (0.0, 1.0)
+    scale = (len(lut) - 1) / (high - low) if high > low else 0.0
+    indices = np.clip(((values - low) * scale).astype(np.int64), 0, len(lut) - 1)
+    return lut[indices]
+
+
 class AstrocytesContact(object):
     
     def __init__(self):
@@ -26,6 +73,18 @@ class AstrocytesContact(object):
         self.transforms = None
         self.measures = None
         self.vertices_colors = None
+        self.laplacians = {} # id(mesh) -> (mesh, topology hash, {weights: sparse smoothing operator})
+        self.fields_cache = {} # id(mesh) -> (mesh, {field or colors key: array})
+
+    # Scalar fields that can be displayed as colors: name -> (kind, default colormap). See `map_to_colors`.
+    # 'rgb' fields are colors already.
+    FIELDS = {
+        'coordinates': ('rgb', None),
+        'curvature': ('scalar', 'red'),
+        'exterior': ('flag', 'exterior'),
+        'holes': ('label', 'labels'),
+        'component': ('label', 'labels')
+    }
 
     def open_mesh(self, path, scale=1.0):
         """
@@ -38,6 +97,7 @@ class AstrocytesContact(object):
             m.vertices = o3d.utility.Vector3dVector(vertices * scale)
             m.compute_vertex_normals()
             m.compute_triangle_normals()
+        self._prune_caches()
 
     def _mesh_to_origin(self, mesh):
         """
@@ -83,23 +143,215 @@ class AstrocytesContact(object):
                 component_mesh = mesh.select_by_index(indices_v) # Selecting desired vertices
                 meshes.append(component_mesh)
         self.meshes = meshes
+        self._prune_caches()
     
-    def merge_close_vertices(self, threshold):
+    @staticmethod
+    def _close_pairs(vertices, threshold, chunk_size=1000000):
         """
-        Merges vertices that are closer than the threshold.
+        Finds all the pairs of vertices closer than `threshold`.
+        A hash grid (cells of size `threshold`, aligned on the origin) only provides the candidates:
+        the partners of a vertex can only be in its cell or in the 26 neighboring ones, their distance is then checked.
+        Candidates are generated for `chunk_size` vertices at a time, which bounds the size of the largest temporary arrays.
+
+        Returns:
+            - Two arrays of vertex indices (i < j).
+        """
+        cells = np.floor(vertices / threshold).astype(np.int64)
+        cells -= cells.min(axis=0) - 1 # Margin of one cell, so the neighbors' coordinates are never negative.
+        dims = cells.max(axis=0) + 2
+        keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+        order = np.argsort(keys, kind='stable')
+        cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+        offsets = np.stack(np.meshgrid(*[np.arange(-1, 2)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+        offsets = (offsets[:, 0] * dims[1] + offsets[:, 1]) * dims[2] + offsets[:, 2]
+
+        all_i, all_j = [], []
+        for start in range(0, len(vertices), chunk_size):
+            # Vertices are visited in the order of their cells: the searches are done on sorted keys, which is much faster.
+            sources = order[start:start + chunk_size]
+            for offset in offsets:
+                neighbors = keys[sources] + offset
+                positions = np.minimum(np.searchsorted(cell_keys, neighbors), len(cell_keys) - 1)
+                found = cell_keys[positions] == neighbors
+                i, positions = sources[found], positions[found]
+                # Each vertex is paired with every vertex of the neighboring cell.
+                counts = cell_counts[positions]
+                ranks = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+                i = np.repeat(i, counts)
+                j = order[np.repeat(cell_starts[positions], counts) + ranks]
+                keep = (i < j) & (np.linalg.norm(vertices[i] - vertices[j], axis=1) < threshold)
+                all_i.append(i[keep])
+                all_j.append(j[keep])
+        if len(all_i) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(all_i), np.concatenate(all_j)
+
+    @staticmethod
+    def _merge_arrays(vertices, faces, threshold, chunk_size=1000000):
         """
-        for mesh in self.meshes:
-            mesh.merge_close_vertices(threshold)
-    
-    def _smooth_mesh(self, mesh, iterations):
-        return mesh.filter_smooth_simple(number_of_iterations=iterations)
+        Merges the vertices that are closer than `threshold` (see `_close_pairs`).
+        Close vertices are joined transitively: each group is a connected component of the "closer than" graph,
+        and it is replaced by its average position.
+        Faces are remapped, then the degenerate (collapsed) and duplicated triangles are removed.
+
+        Returns:
+            - The new vertices, the new faces and a dictionary of statistics.
+        """
+        n_vertices = len(vertices)
+        i, j = AstrocytesContact._close_pairs(vertices, threshold, chunk_size) if n_vertices > 0 else ([], [])
+        graph = sp.coo_matrix((np.ones(len(i), dtype=np.int8), (i, j)), shape=(n_vertices, n_vertices))
+        n_clusters, clusters = connected_components(graph, directed=False)
+        counts = np.bincount(clusters, minlength=n_clusters)
+        new_vertices = np.stack([
+            np.bincount(clusters, weights=vertices[:, axis], minlength=n_clusters) for axis in range(3)
+        ], axis=1) / counts[:, np.newaxis]
+
+        kept_faces = []
+        n_degenerate = 0
+        for i in range(0, len(faces), chunk_size):
+            remapped = clusters[faces[i:i+chunk_size]]
+            degenerate = (remapped[:, 0] == remapped[:, 1]) | (remapped[:, 1] == remapped[:, 2]) | (remapped[:, 0] == remapped[:, 2])
+            n_degenerate += int(np.count_nonzero(degenerate))
+            kept_faces.append(remapped[~degenerate])
+        new_faces = np.concatenate(kept_faces) if kept_faces else np.zeros((0, 3), dtype=np.int64)
+        # Two triangles using the same vertices are duplicates, whatever their winding: the first one is kept.
+        sorted_faces = np.sort(new_faces, axis=1).astype(np.int64) # connected_components gives int32 labels: packing needs 64 bits.
+        if n_clusters < 2**21:
+            # Packing the 3 indices in a single integer is much faster than comparing rows.
+            sorted_faces = (sorted_faces[:, 0] << 42) | (sorted_faces[:, 1] << 21) | sorted_faces[:, 2]
+            _, first = np.unique(sorted_faces, return_index=True)
+        else:
+            _, first = np.unique(sorted_faces, axis=0, return_index=True)
+        n_duplicates = len(new_faces) - len(first)
+        new_faces = new_faces[np.sort(first)]
+
+        stats = {
+            'vertices_before': n_vertices,
+            'vertices_after': n_clusters,
+            'merged_vertices': n_vertices - n_clusters,
+            'faces_before': len(faces),
+            'faces_after': len(new_faces),
+            'degenerate_faces': n_degenerate,
+            'duplicate_faces': n_duplicates
+        }
+        return new_vertices, new_faces, stats
+
+    def merge_close_vertices(self, threshold, chunk_size=1000000):
+        """
+        Merges vertices that are closer than the threshold, using a spatial hash grid to find them (see `_merge_arrays`).
+        Returns the merge statistics of each mesh.
+        """
+        all_stats = []
+        for i, mesh in enumerate(self.meshes):
+            vertices, faces, stats = self._merge_arrays(np.asarray(mesh.vertices), np.asarray(mesh.triangles), threshold, chunk_size)
+            merged = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(vertices), o3d.utility.Vector3iVector(faces.astype(np.int32)))
+            merged.compute_vertex_normals()
+            merged.compute_triangle_normals()
+            self.meshes[i] = merged
+            all_stats.append(stats)
+        self._prune_caches()
+        print(f"Merged {sum(s['merged_vertices'] for s in all_stats)} vertices and removed {sum(s['faces_before'] - s['faces_after'] for s in all_stats)} faces")
+        return all_stats
     
-    def smooth_meshes(self, iterations):
+    @staticmethod
+    def _build_laplacian(vertices, faces, weights='uniform'):
         """
-        Smooths all the meshes in the list.
+        Builds the normalized Laplacian operator L = D^-1 W - I as a sparse float32 matrix.
+        With L, a smoothing step is: v += factor * (L @ v).
+
+        Args:
+            - weights (str): 'uniform' (each neighbor counts the same) or 'cotangent' (weights given by the angles opposite to each edge).
+                             Cotangent weights are computed from the geometry at the time the operator is built.
+        """
+        n_vertices = len(vertices)
+        i, j, k = faces[:, 0], faces[:, 1], faces[:, 2]
+        rows = np.concatenate([i, j, k])
+        cols = np.concatenate([j, k, i])
+        if weights == 'cotangent':
+            # Weight of the edge (a, b): cotangent of the angle at the third vertex c.
+            a, b, c = rows, cols, np.concatenate([k, i, j])
+            e1 = vertices[a] - vertices[c]
+            e2 = vertices[b] - vertices[c]
+            cross = np.linalg.norm(np.cross(e1, e2), axis=1)
+            data = np.divide(np.einsum('ij,ij->i', e1, e2), cross, out=np.zeros(len(a)), where=cross > 0)
+            data = np.clip(data, 0.0, None) * 0.5 # Negative weights (obtuse angles) make the smoothing unstable.
+        else:
+            data = np.ones(len(rows))
+        W = sp.coo_matrix((np.concatenate([data, data]), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))), shape=(n_vertices, n_vertices)).tocsr()
+        if weights != 'cotangent':
+            W.data[:] = 1.0 # Interior edges were counted twice.
+        degrees = np.asarray(W.sum(axis=1)).ravel()
+        connected = degrees > 0
+        inv_degrees = np.divide(1.0, degrees, out=np.zeros_like(degrees), where=connected)
+        L = sp.diags(inv_degrees) @ W - sp.diags(connected.astype(np.float64))
+        return L.astype(np.float32).tocsr()
+
+    def laplacian(self, mesh, weights='uniform'):
+        """
+        Returns the Laplacian operator of a mesh.
+        Operators are cached with the mesh object they belong to, and only rebuilt if its topology (the triangles) changes.
+        The cache only pays off when the same meshes are smoothed several times (e.g. trying different parameters):
+        `flatten` and `fill_holes` create new meshes, so the two smoothings of `run_workflow` don't share operators.
         """
-        for i in range(len(self.meshes)):
-            self.meshes[i] = self._smooth_mesh(self.meshes[i], iterations)
+        faces = np.asarray(mesh.triangles)
+        topology = (hashlib.sha1(np.ascontiguousarray(faces).tobytes()).hexdigest(), len(mesh.vertices))
+        entry = self.laplacians.get(id(mesh))
+        if (entry is None) or (entry[0] is not mesh) or (entry[1] != topology):
+            # The mesh is kept in the entry, so its id can't be reused by another mesh while it is cached.
+            entry = (mesh, topology, {})
+            self.laplacians[id(mesh)] = entry
+        operators = entry[2]
+        if weights not in operators:
+            operators[weights] = self._build_laplacian(np.asarray(mesh.vertices), faces, weights)
+        return operators[weights]
+
+    @staticmethod
+    def _smooth_points(points, L, iterations, lamb, mu):
+        """
+        Applies the smoothing steps in place on a float32 array of points.
+        If `mu` is None, it is a plain Laplacian smoothing (which shrinks the mesh),
+        otherwise each iteration is a Taubin step: a smoothing with `lamb` followed by an inflation with `mu` (< -lamb).
+        """
+        factors = [lamb] if mu is None else [lamb, mu]
+        for _ in range(iterations):
+            for factor in factors:
+                points += factor * (L @ points)
+        return points
+
+    def smooth_meshes(self, iterations, lamb=0.5, mu=-0.53, weights='uniform', batched=True):
+        """
+        Smooths all the meshes in the list, in place.
+        By default, Taubin smoothing is used to avoid shrinking the thin contact surfaces (use `mu=None` for a Laplacian smoothing).
+        If `batched` is True, all the meshes are smoothed at once through a block-diagonal operator.
+        """
+        if len(self.meshes) == 0:
+            return
+        self._prune_caches() # Operators of the meshes that were replaced are dropped.
+        operators = [self.laplacian(mesh, weights) for mesh in self.meshes]
+        if batched:
+            counts = [len(mesh.vertices) for mesh in self.meshes]
+            points = np.concatenate([np.asarray(mesh.vertices) for mesh in self.meshes]).astype(np.float32)
+            self._smooth_points(points, sp.block_diag(operators, format='csr'), iterations, lamb, mu)
+            all_points = np.split(points, np.cumsum(counts)[:-1])
+        else:
+            all_points = [self._smooth_points(np.asarray(mesh.vertices).astype(np.float32), L, iterations, lamb, mu) for mesh, L in zip(self.meshes, operators)]
+        for mesh, points in zip(self.meshes, all_points):
+            np.asarray(mesh.vertices)[:] = points # Open3D's buffer is written in place, no copy of the mesh.
+            mesh.compute_vertex_normals()
+            mesh.compute_triangle_normals()
+        self.fields_cache.clear() # Geometry changed: fields are outdated.
+
+    @staticmethod
+    def _pointing_to(vertices, normals, targets, threshold=1e-6):
+        """
+        For each vertex, checks whether its normal points towards its target point (dot product > threshold).
+        A vertex located on its target has no direction: it is considered as not pointing to it.
+        """
+        directions = targets - vertices
+        lengths = np.linalg.norm(directions, axis=1) * np.linalg.norm(normals, axis=1)
+        dot_products = np.einsum('ij,ij->i', normals, directions)
+        dot_products = np.divide(dot_products, lengths, out=np.zeros_like(dot_products), where=lengths > 0)
+        return dot_products > threshold
 
     def normals_pointing_to_origin(self, mesh, threshold=1e-6):
         """
@@ -118,32 +370,72 @@ class AstrocytesContact(object):
         vertices = np.asarray(mesh.vertices)
         normals  = np.asarray(mesh.vertex_normals)
         
-        vertex_directions = -vertices  # Vectors towards the origin.
-        vertex_directions /= np.linalg.norm(vertex_directions, axis=1)[:, np.newaxis]
-
-        dot_products = np.einsum('ij,ij->i', normals, vertex_directions) # dot_product(normals, vertex_directions)
-        is_pointing_to_origin = dot_products > threshold
-        
-        return is_pointing_to_origin
+        return self._pointing_to(vertices, normals, np.zeros_like(vertices), threshold)
     
-    def flatten(self):
+    def flatten(self, factor=0.2, threshold=1e-6):
         """
         Takes a volume mesh and transforms it into a surface mesh.
         The produced object is a 2D plane deformed in a way that it takes a 3D space to represent it.
         This surface has no thickness as it is a 2D object.
         Depending on the threshold used for `normals_pointing_to_origin`, there can be a small part of transitive area left over.
-        """
+
+        All the components are processed in one pass over their concatenated vertices (segments delimited by offsets).
+        Meshes are not translated: the test is done against each component's centroid.
+        If no vertex of a component points to its centroid, the reference point is moved by `factor` along the average normal (as in `mesh_to_origin`).
+
+        Components without vertices are dropped (a segment can't be empty).
+
+        Returns:
+            - (list): The time (in seconds) spent on each input component. The batched part is shared evenly.
+        """
+        n_inputs = len(self.meshes)
+        indices = [i for i, mesh in enumerate(self.meshes) if len(mesh.vertices) > 0]
+        meshes = [self.meshes[i] for i in indices]
+        if len(meshes) == 0:
+            self.meshes = []
+            self._prune_caches()
+            return [0.0] * n_inputs
+        start = time.perf_counter()
+        for mesh in meshes:
+            if not mesh.has_vertex_normals():
+                mesh.compute_vertex_normals()
+        counts = np.array([len(mesh.vertices) for mesh in meshes])
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        segments = np.repeat(np.arange(len(meshes)), counts)
+        vertices = np.concatenate([np.asarray(mesh.vertices) for mesh in meshes])
+        normals = np.concatenate([np.asarray(mesh.vertex_normals) for mesh in meshes])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+        # Centroids and fallback directions of all the components at once.
+        centers = np.add.reduceat(vertices, offsets[:-1], axis=0) / counts[:, np.newaxis]
+        avg_normals = np.add.reduceat(normals, offsets[:-1], axis=0)
+        lengths = np.linalg.norm(avg_normals, axis=1, keepdims=True)
+        avg_normals = np.divide(avg_normals, lengths, out=np.zeros_like(avg_normals), where=lengths > 0)
+
+        good_vertices = self._pointing_to(vertices, normals, centers[segments], threshold)
+        fallback = np.bincount(segments, weights=good_vertices, minlength=len(meshes)) == 0
+        redo = fallback[segments]
+        if np.any(redo):
+            targets = centers - avg_normals * factor
+            good_vertices[redo] = self._pointing_to(vertices[redo], normals[redo], targets[segments[redo]], threshold)
+
+        # Single gather of the kept vertices, then split back into local indices per component.
+        kept = np.flatnonzero(good_vertices)
+        local_idx = np.split(kept - offsets[segments[kept]], np.searchsorted(kept, offsets[1:-1]))
+        shared = (time.perf_counter() - start) / n_inputs
+
         new_meshes = []
-        for mesh in self.meshes:
-            center = self.mesh_to_origin(mesh)
-            good_vertices = self.normals_pointing_to_origin(mesh)
-            vertices_idx = np.where(good_vertices)[0]
-            if len(vertices_idx) == 0:
-                continue
-            component_mesh = mesh.select_by_index(vertices_idx)
-            component_mesh.translate(center)
-            new_meshes.append(component_mesh)
+        timings = [0.0] * n_inputs
+        for i, mesh, vertices_idx in zip(indices, meshes, local_idx):
+            start = time.perf_counter()
+            if len(vertices_idx) > 0:
+                new_meshes.append(mesh.select_by_index(vertices_idx))
+            timings[i] = shared + time.perf_counter() - start
+        print(f"Flattened {n_inputs} components into {len(new_meshes)} surfaces in {sum(timings):.3f}s")
         self.meshes = new_meshes
+        self._prune_caches()
+        return timings
 
     def fill_holes(self, size=0.02):
         """
@@ -157,15 +449,108 @@ class AstrocytesContact(object):
             mesh_filled.compute_vertex_normals()
             mesh_filled.compute_triangle_normals()
             self.meshes[i] = mesh_filled
+        self._prune_caches()
 
-    def decimate(self, factor):
+    @staticmethod
+    def _distribute_budget(weights, capacities, budget, minimum=4):
         """
-        Factor is a float between 0 and 1.
-        It represents the percentage of faces to keep.
+        Splits a number of faces between components, proportionally to their weights.
+        A component can't receive more faces than it has (its capacity): the excess is given back to the others.
+        Each component first receives `minimum` faces (less if the budget is too small), taken from the budget.
+
+        Returns:
+            - (np.array): The number of faces allocated to each component, their sum doesn't exceed the budget.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        capacities = np.asarray(capacities, dtype=np.float64)
+        active = capacities > 0
+        minimum = min(minimum, budget // max(np.count_nonzero(active), 1))
+        reserved = np.minimum(minimum, capacities)
+        capacities = capacities - reserved
+        allocation = np.zeros(len(weights))
+        active &= capacities > 0
+        remaining = float(budget - np.sum(reserved))
+        while np.any(active):
+            total = np.sum(weights[active])
+            share = remaining * weights / total if total > 0 else np.full(len(weights), remaining / np.count_nonzero(active))
+            full = active & (share >= capacities)
+            if not np.any(full):
+                allocation[active] = share[active]
+                break
+            allocation[full] = capacities[full]
+            remaining -= np.sum(capacities[full])
+            active &= ~full
+        # Faces lost by rounding down go to the largest fractional parts.
+        rounded = np.floor(allocation)
+        leftover = int(round(np.sum(allocation - rounded)))
+        rounded[np.argsort(rounded - allocation, kind='stable')[:leftover]] += 1
+        return (reserved + rounded).astype(int)
+
+    @staticmethod
+    def _decimation_error(original, decimated):
         """
-        for i, mesh in enumerate(self.meshes):
-            decimated = mesh.simplify_quadric_decimation(int(len(mesh.triangles) * factor))
+        Approximates the geometric error as the distance from each original vertex to the closest vertex of the decimated mesh.
+        Both arguments are arrays of vertices. Returns the mean and max errors.
+        """
+        if len(decimated) == 0:
+            return float('inf'), float('inf')
+        distances, _ = cKDTree(decimated).query(original)
+        return float(np.mean(distances)), float(np.max(distances))
+
+    def decimate(self, factor=None, target_faces=None, target_error=None, weighting='area', workers=None):
+        """
+        Reduces the number of faces of the meshes with `simplify_quadric_decimation`.
+        Exactly one of the targets has to be provided (ValueError otherwise):
+            - factor (float): Between 0 and 1, the percentage of faces to keep in every mesh.
+            - target_faces (int): Total number of faces for all the meshes together.
+                                  The budget is distributed according to `weighting`:
+                                  'area' (surface area) or 'curvature' (area weighted by the mean angular curvature).
+            - target_error (float): Maximal quadric error allowed. The face target of each mesh is set to 4 (a tetrahedron):
+                                    the decimation only stops when the next collapse would exceed the error.
+        Components are decimated in parallel by `workers` processes (Open3D holds the GIL, threads would run one at a time).
+        Use `workers=1` to stay in the current process, which is faster for a few small meshes.
+
+        Returns:
+            - (list): For each mesh, the number of faces before/after, the target and the achieved error (mean and max).
+        """
+        if sum(target is not None for target in (factor, target_faces, target_error)) != 1:
+            raise ValueError("Exactly one of 'factor', 'target_faces' and 'target_error' must be provided")
+        n_faces = np.array([len(mesh.triangles) for mesh in self.meshes])
+        if target_faces is not None:
+            weights = np.array([mesh.get_surface_area() for mesh in self.meshes])
+            if weighting == 'curvature':
+                weights *= 1.0 + np.array([np.mean(c) for c in self.discrete_angular_curvature()])
+            targets = self._distribute_budget(weights, n_faces, target_faces)
+        elif factor is not None:
+            targets = (n_faces * factor).astype(int)
+        else:
+            targets = np.minimum(n_faces, 4) # Only the error limits the decimation.
+
+        # Open3D meshes are sent to the workers as arrays.
+        jobs = [(np.asarray(mesh.vertices), np.asarray(mesh.triangles), int(t), target_error) for mesh, t in zip(self.meshes, targets)]
+        if workers == 1 or len(jobs) < 2:
+            results = [_decimate_arrays(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_decimate_arrays, *zip(*jobs)))
+
+        report = []
+        for i, (vertices, faces, mean_error, max_error) in enumerate(results):
+            decimated = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(vertices), o3d.utility.Vector3iVector(faces))
+            decimated.compute_vertex_normals()
+            decimated.compute_triangle_normals()
             self.meshes[i] = decimated
+            report.append({
+                'faces_before': int(n_faces[i]),
+                'faces_target': int(targets[i]),
+                'faces_after': len(decimated.triangles),
+                'mean_error': mean_error,
+                'max_error': max_error
+            })
+        self._prune_caches()
+        if report:
+            print(f"Decimated {int(np.sum(n_faces))} faces to {sum(r['faces_after'] for r in report)} (max error: {max(r['max_error'] for r in report):.4f})")
+        return report
     
     def _get_all_edges(self, mesh):
         """
@@ -306,36 +691,87 @@ class AstrocytesContact(object):
         """
         return [self._process_n_holes(m, e) for m, e in zip(self.meshes, self.get_exterior_vertices())]
     
-    def _edge_loop_to_colors(self, mesh, holes):
-        v_colors = np.zeros((len(mesh.vertices), 3), dtype=np.float32)
-        v_colors += 0.75
-        for i, hole in enumerate(holes):
-            rdm_color = np.random.rand(3)
-            for v_index in hole:
-                v_colors[v_index] = rdm_color
-        return v_colors
+    def _compute_field(self, i, name):
+        mesh = self.meshes[i]
+        n_vertices = len(mesh.vertices)
+        if name == 'coordinates':
+            coordinates = np.asarray(mesh.vertices, dtype=np.float32)
+            lower = coordinates.min(axis=0)
+            extent = coordinates.max(axis=0) - lower
+            return np.divide(coordinates - lower, extent, out=np.zeros_like(coordinates), where=extent > 0)
+        if name == 'curvature':
+            return self._discrete_angular_curvature(mesh)
+        if name == 'exterior':
+            return self._get_exterior_vertices(mesh).astype(np.float32)
+        if name == 'holes':
+            holes = self._process_n_holes(mesh, self.scalar_field(i, 'exterior') > 0)
+            ids = np.full(n_vertices, -1, dtype=np.int64)
+            if len(holes) > 0:
+                ids[np.concatenate(holes).astype(np.int64)] = np.repeat(np.arange(len(holes)), [len(h) for h in holes])
+            return ids
+        if name == 'component':
+            return np.full(n_vertices, i, dtype=np.int64)
+        raise ValueError(f"Unknown field: {name}")
+
+    def _prune_caches(self):
+        """
+        Drops the cached fields and operators of the meshes that are no longer in the list.
+        Entries keep a reference to their mesh: without this, replaced meshes would stay in memory.
+        """
+        alive = {id(mesh): mesh for mesh in self.meshes}
+        self.fields_cache = {k: e for k, e in self.fields_cache.items() if alive.get(k) is e[0]}
+        self.laplacians = {k: e for k, e in self.laplacians.items() if alive.get(k) is e[0]}
+
+    def _mesh_cache(self, mesh):
+        entry = self.fields_cache.get(id(mesh))
+        if (entry is None) or (entry[0] is not mesh):
+            entry = (mesh, {})
+            self.fields_cache[id(mesh)] = entry
+        return entry[1]
+
+    def scalar_field(self, i, name):
+        """
+        Returns the field `name` (see `FIELDS`) of the i-th mesh.
+        It is computed on the first call and cached until the mesh changes.
+        The 'component' field depends on the position of the mesh in the list, so it is never cached.
+        """
+        if name == 'component':
+            return self._compute_field(i, name)
+        cache = self._mesh_cache(self.meshes[i])
+        if name not in cache:
+            cache[name] = self._compute_field(i, name)
+        return cache[name]
+
+    def color_by(self, name, colormap=None, percentiles=(1, 99)):
+        """
+        Fills 'vertices_colors' with the field `name` mapped through a colormap (see `COLORMAPS`).
+        The colors are cached per mesh, so switching between fields that were already shown is instant.
+        """
+        kind, default_colormap = self.FIELDS[name]
+        colormap = default_colormap if colormap is None else colormap
+        self._prune_caches()
+        self.vertices_colors = []
+        for i, mesh in enumerate(self.meshes):
+            # Colors of the components are computed at each call, the index of a mesh can change.
+            cache = {} if name == 'component' else self._mesh_cache(mesh)
+            key = ('colors', name, colormap, percentiles)
+            if key not in cache:
+                values = self.scalar_field(i, name)
+                cache[key] = values if kind == 'rgb' else map_to_colors(values, kind, colormap, percentiles)
+            self.vertices_colors.append(cache[key])
+        return self.vertices_colors
 
     def edge_loop_to_colors(self):
         """
-        Returns the list of exterior vertices for each mesh.
+        Assigns a color to each hole (edge loop) of each mesh.
         """
-        self.vertices_colors = []
-        all_holes = self.process_n_holes()
-        for mesh, holes in zip(self.meshes, all_holes):
-            v_colors = self._edge_loop_to_colors(mesh, holes)
-            self.vertices_colors.append(v_colors)
+        self.color_by('holes')
 
     def exterior_vertices_to_colors(self):
         """
-        Returns the list of exterior vertices for each mesh.
+        Colors the exterior vertices in red.
         """
-        self.vertices_colors = []
-        for mesh in self.meshes:
-            vtcs = np.where(self._get_exterior_vertices(mesh))[0]
-            colors = np.zeros((len(mesh.vertices), 3), dtype=np.float32)
-            colors += 0.75
-            colors[vtcs] = [1.0, 0.0, 0.0]
-            self.vertices_colors.append(colors)
+        self.color_by('exterior')
     
     def _discrete_angular_curvature(self, mesh):
         curvature = np.zeros(len(mesh.vertices))
@@ -366,36 +802,141 @@ class AstrocytesContact(object):
         """
         Computes the angular curvature for each mesh and assigns a color to each vertex.
         """
-        self.vertices_colors = []
-        curvatures = self.discrete_angular_curvature()
-        for mesh, curvature in zip(self.meshes, curvatures):
-            colors = np.zeros((len(mesh.vertices), 3), dtype=np.float32)
-            colors[:, 0] = curvature
-            self.vertices_colors.append(colors / np.max(colors))
+        self.color_by('curvature')
 
     def coordinates_to_color(self):
         """
         Assigns a color to each vertex based on its coordinates.
         """
-        self.vertices_colors = []
-        for mesh in self.meshes:
-            colors = np.asarray(mesh.vertices)
-            colors = colors - np.min(colors, axis=0)
-            colors = colors / np.max(colors, axis=0)
-            self.vertices_colors.append(colors)
-                
-    
+        self.color_by('coordinates')
+
 
 ###########################################################
 
-def show_in_napari(acs):
+def _decimate_arrays(vertices, faces, target, target_error=None):
+    """
+    Decimates a mesh given as arrays, and measures the error (see `AstrocytesContact.decimate`).
+    It is a module-level function so it can run in a worker process.
+    """
+    mesh = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(vertices), o3d.utility.Vector3iVector(faces.astype(np.int32)))
+    if target_error is None:
+        decimated = mesh.simplify_quadric_decimation(target)
+    else:
+        decimated = mesh.simplify_quadric_decimation(target, maximum_error=target_error)
+    d_vertices = np.asarray(decimated.vertices).copy()
+    d_faces = np.asarray(decimated.triangles).copy()
+    return (d_vertices, d_faces) + AstrocytesContact._decimation_error(vertices, d_vertices)
+
+
+# Fraction of the faces kept at each level of the pyramid, from the finest to the coarsest.
+LOD_RATIOS = (1.0, 0.25, 0.05)
+
+
+def decimation_pyramid(mesh, ratios=LOD_RATIOS, cache_folder=None):
+    """
+    Decimates a mesh at several levels of detail with `simplify_quadric_decimation`.
+    If a cache folder is provided, each decimated level is stored there as a '.npz' file,
+    named after the hash of the mesh's geometry, so it is only computed once.
+
+    Returns:
+        - (list): A (vertices, faces) tuple of arrays for each ratio.
+    """
+    vertices = np.asarray(mesh.vertices)
+    faces = np.asarray(mesh.triangles)
+    digest = hashlib.sha1(np.ascontiguousarray(vertices).tobytes() + np.ascontiguousarray(faces).tobytes()).hexdigest()
+    levels = []
+    for ratio in ratios:
+        if ratio >= 1.0:
+            levels.append((vertices, faces))
+            continue
+        cache_path = None if cache_folder is None else os.path.join(cache_folder, f"{digest}-{ratio}.npz")
+        if cache_path is not None and os.path.isfile(cache_path):
+            data = np.load(cache_path)
+            levels.append((data['vertices'], data['faces']))
+            continue
+        decimated = mesh.simplify_quadric_decimation(max(int(len(faces) * ratio), 4))
+        level = (np.asarray(decimated.vertices), np.asarray(decimated.triangles))
+        if cache_path is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+            np.savez(cache_path, vertices=level[0], faces=level[1])
+        levels.append(level)
+    return levels
+
+
+def merge_surfaces(surfaces):
+    """
+    Merges a list of (vertices, faces) tuples in a single surface.
+    Returns the vertices, the faces (with shifted indices) and the component ID of each vertex.
+    """
+    counts = [len(v) for v, _ in surfaces]
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    vertices = np.concatenate([v for v, _ in surfaces]).astype(np.float32)
+    faces = np.concatenate([f + o for (_, f), o in zip(surfaces, offsets)])
+    component_ids = np.repeat(np.arange(len(surfaces)), counts).astype(np.float32)
+    return vertices, faces, component_ids
+
+
+def lod_pyramid(acs, ratios=LOD_RATIOS, cache_folder=None):
+    """
+    Builds the merged surface of all the components at each level of detail.
+    Returns a list of (vertices, faces, component_ids), from the finest to the coarsest level.
+    """
+    pyramids = [decimation_pyramid(mesh, ratios, cache_folder) for mesh in acs.meshes]
+    return [merge_surfaces([p[level] for p in pyramids]) for level in range(len(ratios))]
+
+
+def show_lod_in_napari(acs, ratios=LOD_RATIOS, cache_folder=None):
+    """
+    Shows all the components in a single surface layer, colored by component ID.
+    The level of detail is chosen from the camera's zoom: each time the zoom doubles, a finer level is used.
+    """
+    print("--- Building levels of detail ---")
+    levels = lod_pyramid(acs, ratios, cache_folder)
+    viewer = napari.Viewer()
+    coarsest = len(levels) - 1
+    surface = viewer.add_surface(
+        levels[coarsest],
+        name="Astrocytes",
+        shading='smooth',
+        colormap='turbo',
+        contrast_limits=(0, max(len(acs.meshes) - 1, 1))
+    )
+    viewer.reset_view()
+    reference_zoom = viewer.camera.zoom
+    current = [coarsest]
+
+    def on_zoom(event):
+        ratio = max(viewer.camera.zoom / reference_zoom, 1e-6)
+        level = int(np.clip(coarsest - math.floor(math.log2(ratio)), 0, coarsest))
+        if level != current[0]:
+            current[0] = level
+            surface.data = levels[level]
+
+    viewer.camera.events.zoom.connect(on_zoom)
+    napari.run()
+
+
+def show_in_napari(acs, lod=False, cache_folder=None, color_mode='coordinates'):
+    """
+    Shows each mesh in its own layer, colored by `color_mode` (see `AstrocytesContact.FIELDS`).
+    Press 'c' in the viewer to switch to the next coloration.
+    """
+    if lod:
+        show_lod_in_napari(acs, cache_folder=cache_folder)
+        return
     viewer = napari.Viewer()
-    # Choosing coloration:
-    # acs.exterior_vertices_to_colors()
-    # acs.edge_loop_to_colors()
-    # acs.angular_curvature_to_color()
-    acs.coordinates_to_color()
-    # -----------
+    acs.color_by(color_mode)
+    surfaces = []
+    modes = list(acs.FIELDS)
+    current = [modes.index(color_mode)]
+
+    @viewer.bind_key('c')
+    def next_coloration(viewer):
+        current[0] = (current[0] + 1) % len(modes)
+        print(f"Coloration: {modes[current[0]]}")
+        for surface, colors in zip(surfaces, acs.color_by(modes[current[0]])):
+            surface.vertex_colors = colors
+
     for i in range(len(acs.meshes)):
         mesh = acs.meshes[i]
         print(f"--- Adding mesh {i} ---")
@@ -407,6 +948,7 @@ def show_in_napari(acs):
         surface.wireframe.visible = True
         colors = acs.vertices_colors[i]
         surface.vertex_colors = colors
+        surfaces.append(surface)
         print("--")
     napari.run()
 
@@ -429,6 +971,8 @@ def run_workflow():
     #     o3d.io.write_triangle_mesh(f"/home/benedetti/Downloads/I2K/data/astrocytes/astrocytes-{i}.ply", m)
 
     show_in_napari(acs)
+    # For big datasets, use a single layer with levels of detail:
+    # show_in_napari(acs, lod=True, cache_folder=os.path.join(target_folder, "lod-cache"))
 
 
 if __name__ == "__main__":